@@ -3,6 +3,7 @@ from __future__ import annotations
 import argparse
 import contextlib
 import logging
+import re
 import sys
 from pathlib import Path
 
@@ -13,25 +14,74 @@ log = logging.getLogger(__name__)
 BUILDDIR = Path("build")
 
 
-tests = api.tasks.add_task(api.tasks.tests, package="makepyz")
+tests = api.tasks.add_task(
+    api.tasks.tests,
+    package="makepyz",
+    inputs=[
+        "pyproject.toml",
+        "src/**/*.py",
+        "tests/**/*.py",
+        "tests/requirements.txt",
+        "tests/data/*",
+    ],
+    outputs=["build/coverage.json"],
+)
 checks = api.tasks.add_task(api.tasks.checks)
 fmt = api.tasks.add_task(api.tasks.fmt)
 build = api.tasks.add_task(tasks_gh.build, package="makepyz")
 
 
-@api.task()
+@api.task(inputs=["pyproject.toml", "src/**/*.py"], outputs=["*.pyz"])
 def pack(arguments: list[str]):
     """create a one .pyz single file package"""
     from configparser import ConfigParser, ParsingError
 
+    ctx = api.tasks.context()
+
     def parse_arguments(arguments: list[str]):
         parser = argparse.ArgumentParser()
-        parser.add_argument("-o", "--output-dir", default=Path.cwd(), type=Path)
+        parser.add_argument("-o", "--output-dir", default=ctx.basedir, type=Path)
+        parser.add_argument(
+            "-O",
+            "--optimize",
+            type=int,
+            choices=[-1, 0, 1, 2],
+            help="include .pyc files compiled with this optimization level",
+        )
+        parser.add_argument(
+            "--strip", action="store_true", help="drop the sources (needs -O)"
+        )
+        parser.add_argument(
+            "--vendor",
+            action="append",
+            type=Path,
+            help="include the dependencies from the wheels in this dir",
+        )
+        parser.add_argument(
+            "-Z",
+            "--compression",
+            action="append",
+            default=[],
+            help="[TARGET=]METHOD[:LEVEL] (stored or deflated, level 0-9)",
+        )
         return parser.parse_args(arguments)
 
     options = parse_arguments(arguments)
+    options.output_dir = ctx.path(options.output_dir)
+
+    # compression settings by target ("" is the default)
+    compressions = {"": "deflated"}
+    for value in options.compression:
+        target, _, method = value.rpartition("=")
+        compressions[target] = method
+    try:
+        settings = {k: api.packaging.compression(v) for k, v in compressions.items()}
+    except api.packaging.PackagingError as exc:
+        raise api.AbortWrongArgumentError(str(exc)) from exc
+    if options.strip and options.optimize is None:
+        raise api.AbortWrongArgumentError("--strip requires -O/--optimize")
 
-    workdir = Path.cwd()
+    workdir = ctx.basedir
 
     config = ConfigParser(strict=False)
     with contextlib.suppress(ParsingError):
@@ -46,12 +96,35 @@ def pack(arguments: list[str]):
         else:
             targets.append((f"{target}.pyz", entrypoint))
 
-    changed = False
+    extra = []
+    if options.vendor:
+        value = config.get("project", "dependencies", fallback="")
+        dependencies = re.findall(r"[\"']([^\"']+)[\"']", value)
+        extra = api.packaging.vendor(dependencies, options.vendor, ctx.build("vendor"))
+
+    # targets sharing the same compression are built together
+    groups: dict[tuple[int, int | None], list[tuple[Path, str]]] = {}
     for target, entrypoint in targets:
-        dst = options.output_dir / target
-        out = api.makezapp(dst, workdir / "src", main=entrypoint, compressed=True)
+        setting = settings.get(target, settings[""])
+        groups.setdefault(setting, []).append((options.output_dir / target, entrypoint))
+
+    outputs = {}
+    for (method, level), group in groups.items():
+        generated = api.makezapps(
+            group,
+            workdir / "src",
+            compression=method,
+            compresslevel=level,
+            cache=ctx.build("makezapp.json"),
+            optimize=options.optimize,
+            strip=options.strip,
+            extra=extra,
+        )
+        outputs.update(zip([dst for dst, _ in group], generated))
 
-        relpath = dst.relative_to(Path.cwd()) if dst.is_relative_to(Path.cwd()) else dst
+    changed = False
+    for dst, out in outputs.items():
+        relpath = dst.relative_to(workdir) if dst.is_relative_to(workdir) else dst
         if out:
             print(f"Written: {relpath}", file=sys.stderr)
             changed = True
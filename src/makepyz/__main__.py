@@ -1,4 +1,4 @@
-from makepyz.scripts.makepyzui import main
+from makepyz.daemon import main
 
 if __name__ == "__main__":
     main()
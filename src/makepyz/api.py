@@ -1,10 +1,37 @@
 # ruff: noqa: F401
-from . import fileops, github, scm, tasks
+from typing import TYPE_CHECKING
+
+from . import fileops, tasks
 from .cli import (
     MODULE_VARIABLES,
     AbortCliError,
     AbortExitNoTimingError,
     AbortWrongArgumentError,
 )
-from .packaging import makezapp
 from .tasks import task
+
+if TYPE_CHECKING:
+    from . import github, packaging, scm
+    from .packaging import makezapp, makezapps
+
+# imported on first use: make.py pays only for what its tasks use
+_LAZY = {
+    "github": ("makepyz.github", None),
+    "packaging": ("makepyz.packaging", None),
+    "scm": ("makepyz.scm", None),
+    "makezapp": ("makepyz.packaging", "makezapp"),
+    "makezapps": ("makepyz.packaging", "makezapps"),
+}
+
+
+def __getattr__(name: str):
+    import importlib
+
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attribute = _LAZY[name]
+    value = importlib.import_module(module)
+    if attribute:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
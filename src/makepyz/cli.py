@@ -102,12 +102,15 @@ def add_config(parser: MakepyzParser, var: str = "CONFIGPATH") -> Callback:
         options: argparse.Namespace,
         _: list[str],
     ):
-        from makepyz.fileops import loadmod
+        from makepyz.fileops import cachedir, loadmod
 
         options.config = Path(options.config).expanduser().absolute()
-        is_a_module = parser.parser_variables.get("add_config", {}).get(
-            "is-a-module", False
-        )
+        variables = parser.parser_variables.get("add_config", {})
+        is_a_module = variables.get("is-a-module", False)
+        # a (options, arguments) -> bool callback to skip loading the module
+        load_module = variables.get("load-module")
+        # a (path) -> module callback replacing loadmod
+        loader = variables.get("loader")
 
         if hasattr(options, "mod"):
             raise RuntimeError("mod is a reserved dest for options")
@@ -115,7 +118,12 @@ def add_config(parser: MakepyzParser, var: str = "CONFIGPATH") -> Callback:
         if is_a_module:
             if not options.config.exists():
                 raise AbortWrongArgumentError(f"missing config file {options.config}")
-            options.mod = loadmod(options.config)
+            if load_module and not load_module(options, _):
+                return
+            if loader:
+                options.mod = loader(options.config)
+            else:
+                options.mod = loadmod(options.config, cachedir=cachedir() / "modules")
             if hasattr(options.mod, var):
                 raise RuntimeError(f"cannot define {var} in {options.config}")
 
@@ -0,0 +1,328 @@
+"""an opt-in server keeping makepyz warm (set MAKEPYZ_DAEMON=1)
+
+The first makepyz call starts (in background) a server for the project
+make.py and runs as usual, the next ones are sent to the server over a
+unix socket: the client stdin/stdout/stderr are passed along, so the task
+(and its subprocesses) output goes straight to the client terminal, and
+the task is interrupted if the client goes away (eg. on Ctrl-C).
+
+The server has the makepyz modules (and the make.py imports) already
+loaded and make.py is only re-compiled when it changes; it exits after
+being idle for a while or when a module loaded from the project changed.
+
+This module only imports the stdlib, to keep the client start fast.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+from pathlib import Path
+
+IDLE = 900.0  # seconds
+ENVIRONMENT = "MAKEPYZ_DAEMON"
+
+
+def socketpath(config: Path) -> Path:
+    """the server socket path for config (a make.py)"""
+    import hashlib
+    import tempfile
+
+    key = f"{sys.executable}:{config.absolute()}".encode()
+    rundir = Path(tempfile.gettempdir()) / f"makepyz-{os.getuid()}"
+    return rundir / f"{hashlib.sha256(key).hexdigest()[:16]}.sock"
+
+
+def configpath(argv: list[str]) -> Path:
+    """the -c/--config value in argv (see cli.add_config), without argparse"""
+    for index, arg in enumerate(argv):
+        if arg in {"-c", "--config"} and index + 1 < len(argv):
+            return Path(argv[index + 1]).expanduser().absolute()
+        if arg.startswith("--config="):
+            return Path(arg.partition("=")[2]).expanduser().absolute()
+    return Path("make.py").absolute()
+
+
+def _trusted(rundir: Path) -> bool:
+    # the socket directory must be private (another user could create it)
+    import stat
+
+    try:
+        info = os.lstat(rundir)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(info.st_mode)
+        and info.st_uid == os.getuid()
+        and not info.st_mode & 0o077
+    )
+
+
+def _peeruid(sock: socket.socket) -> int | None:
+    # the uid of the process on the other end (None if unsupported)
+    import struct
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    size = struct.calcsize("3i")
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+    return struct.unpack("3i", creds)[1]
+
+
+def _stale(basedir: Path, mtimes: dict[str, int]) -> bool:
+    # true if a module loaded from basedir changed since the server started
+    for name, mtime in mtimes.items():
+        try:
+            if os.stat(name).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    for module in list(sys.modules.values()):
+        filename = getattr(module, "__file__", None)
+        if filename and filename not in mtimes:
+            with contextlib.suppress(OSError, ValueError):
+                if Path(filename).resolve().is_relative_to(basedir):
+                    mtimes[filename] = os.stat(filename).st_mtime_ns
+    return False
+
+
+def _execute(request: dict, fds: list[int]) -> int:
+    import logging
+
+    from makepyz.scripts import makepyzui
+
+    saved = [os.dup(fd) for fd in range(3)]
+    environ = dict(os.environ)
+    cwd = os.getcwd()
+    argv = sys.argv
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        for fd, new in enumerate(fds[:3]):
+            os.dup2(new, fd)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        os.chdir(request["cwd"])
+        sys.argv = ["makepyz", *request["argv"]]
+        # cli.setup_logging configures the root logger again
+        for handler in logging.root.handlers[:]:
+            logging.root.removeHandler(handler)
+        try:
+            makepyzui.main()
+            code = 0
+        except KeyboardInterrupt:
+            code = 130
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else int(bool(exc.code))
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.argv = argv
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        for fd, old in enumerate(saved):
+            os.dup2(old, fd)
+            os.close(old)
+        for fd in fds:
+            os.close(fd)
+    return code
+
+
+def _interrupt() -> None:
+    # a Ctrl-C for the running task: the spawned server leads its own
+    # process group, so its subprocesses get the SIGINT too
+    import signal
+
+    if os.getpgid(0) == os.getpid():
+        os.killpg(os.getpid(), signal.SIGINT)
+    else:
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def _watch(conn: socket.socket, lock: threading.Lock, done: threading.Event):
+    # interrupts the running task (in the main thread) if the client goes away
+    import select
+
+    while not done.is_set():
+        readable, _, _ = select.select([conn], [], [], 0.1)
+        if not readable:
+            continue
+        with contextlib.suppress(OSError):
+            if conn.recv(1 << 10):
+                continue
+        with lock:
+            if not done.is_set():
+                done.set()
+                _interrupt()
+        return
+
+
+def _handle(conn: socket.socket, request: dict, fds: list[int], watch: bool) -> int:
+    # runs the request, stopping it if the client goes away (eg. Ctrl-C)
+    if not watch:
+        return _execute(request, fds)
+    lock = threading.Lock()
+    done = threading.Event()
+    watcher = threading.Thread(target=_watch, args=(conn, lock, done), daemon=True)
+    watcher.start()
+    interrupted = False
+    try:
+        try:
+            code = _execute(request, fds)
+        finally:
+            with lock:
+                interrupted = done.is_set()
+                done.set()
+    except KeyboardInterrupt:
+        # the SIGINT landed after the task completed
+        if not interrupted:
+            raise
+        code = 130
+    watcher.join()
+    return code
+
+
+def serve(config: Path, path: Path | None = None, idle: float = IDLE) -> None:
+    """serves the makepyz requests for config on path"""
+    path = path or socketpath(config)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not _trusted(path.parent):
+        raise RuntimeError(f"{path.parent} is not private to the current user")
+
+    mtimes: dict[str, int] = {}
+    _stale(config.parent, mtimes)
+    # only the main thread can be interrupted when a client goes away
+    watch = threading.current_thread() is threading.main_thread()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+        server.bind(str(path))
+        server.listen()
+        server.settimeout(idle)
+        try:
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    break
+                with conn:
+                    conn.settimeout(None)
+                    data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+                    while not data.endswith(b"\n") and (chunk := conn.recv(1 << 16)):
+                        data += chunk
+                    request = json.loads(data)
+                    if request.get("stop") or _stale(config.parent, mtimes):
+                        for fd in fds:
+                            os.close(fd)
+                        with contextlib.suppress(OSError):
+                            conn.sendall(json.dumps({"exit": None}).encode())
+                        break
+                    code = _handle(conn, request, fds, watch)
+                    _stale(config.parent, mtimes)
+                    with contextlib.suppress(OSError):
+                        conn.sendall(json.dumps({"exit": code}).encode())
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+
+
+def request(path: Path, argv: list[str], stop: bool = False) -> int | None:
+    """runs makepyz argv on the server at path (None if not served)
+
+    The server must run as the current user, in a private directory:
+    the request carries the environment and the stdin/stdout/stderr.
+    """
+    if not _trusted(path.parent):
+        return None
+    data = json.dumps(
+        {
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "stop": stop,
+        }
+    ).encode()
+    reply = b""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+            if _peeruid(sock) not in {None, os.getuid()}:
+                return None
+            # the connection stays open while the task runs: closing it
+            # (eg. on Ctrl-C) stops the task
+            sent = socket.send_fds(sock, [data + b"\n"], [0, 1, 2])
+            sock.sendall((data + b"\n")[sent:])
+            while chunk := sock.recv(1 << 16):
+                reply += chunk
+        except KeyboardInterrupt:
+            return 130
+        except OSError:
+            return None
+    return json.loads(reply)["exit"] if reply else None
+
+
+def spawn(config: Path, path: Path | None = None, idle: float = IDLE):
+    """starts a server for config in background"""
+    import subprocess
+
+    # the makepyz package might be in a zipapp, make.py imports might rely
+    # on the user PYTHONPATH
+    pythonpath = [str(Path(__file__).parent.parent), os.getenv("PYTHONPATH", "")]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, pythonpath))}
+    env.pop(ENVIRONMENT, None)
+    args = [sys.executable, "-m", "makepyz.daemon", str(config), "--idle", str(idle)]
+    if path:
+        args.extend(["--socket", str(path)])
+    return subprocess.Popen(  # noqa: S603
+        args,
+        env=env,
+        cwd=config.parent,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def main():
+    """the makepyz entry point: uses the server if enabled"""
+    if os.getenv(ENVIRONMENT, "") not in {"", "0"} and sys.platform != "win32":
+        config = configpath(sys.argv[1:])
+        path = socketpath(config)
+        code = request(path, sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+        if path.parent.exists() and not _trusted(path.parent):
+            print(f"makepyz: not using {path.parent} (not private)", file=sys.stderr)  # noqa: T201
+        elif config.exists():
+            spawn(config, path)
+
+    from makepyz.scripts.makepyzui import main as makepyz
+
+    makepyz()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="makepyz server")
+    parser.add_argument("config", type=Path, help="the make.py to serve")
+    parser.add_argument("--idle", type=float, default=IDLE)
+    parser.add_argument("--socket", type=Path)
+    parser.add_argument("--stop", action="store_true", help="stop the server")
+    options = parser.parse_args()
+    config = options.config.expanduser().absolute()
+    if options.stop:
+        request(options.socket or socketpath(config), [], stop=True)
+    else:
+        serve(config, options.socket, options.idle)
@@ -3,14 +3,30 @@
 from __future__ import annotations
 
 import contextlib
+import contextvars
+import dataclasses as dc
+import io
+import logging
+import mmap
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import types
+from importlib.machinery import SourceFileLoader
 from pathlib import Path
-from typing import Iterator, overload
+from typing import IO, TYPE_CHECKING, Any, Iterator, Mapping, Union, overload
+
+from . import trace
+
+if TYPE_CHECKING:
+    from tarfile import TarFile
+    from zipfile import ZipFile
+
+log = logging.getLogger(__name__)
 
 
 class FileOSError(Exception):
@@ -25,9 +41,51 @@ class FileOSMInvalidModuleError(FileOSError):
     pass
 
 
-def rmtree(path: Path):
-    """universal (win|*nix) rmtree"""
-
+def _rmtree(path: Path, workers: int | None = None) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    # collects files/dirs with os.scandir, unlinks the files in parallel
+    # and then removes the dirs (deepest first)
+    dirs: list[str] = []
+    files: list[str] = []
+    pending = [str(path)]
+    while pending:
+        current = pending.pop()
+        dirs.append(current)
+        with contextlib.suppress(OSError), os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    files.append(entry.path)
+
+    def unlink(names: list[str]) -> None:
+        for name in names:
+            with contextlib.suppress(OSError):
+                os.unlink(name)
+
+    n = workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        chunk = 512
+        list(
+            pool.map(
+                unlink, [files[i : i + chunk] for i in range(0, len(files), chunk)]
+            )
+        )
+    for name in reversed(dirs):
+        with contextlib.suppress(OSError):
+            os.rmdir(name)
+
+
+def rmtree(
+    path: Path, background: bool = False, workers: int | None = None
+) -> threading.Thread | None:
+    """universal (win|*nix) rmtree
+
+    With workers (or background) the files are unlinked by a thread pool;
+    with background the path is first renamed aside (so it is gone as soon
+    as this returns) and deleted by the returned (non daemon) thread.
+    """
     from os import name
     from shutil import rmtree
     from stat import S_IWUSR
@@ -35,9 +93,20 @@ def rmtree(path: Path):
     if name == "nt":
         for p in path.rglob("*"):
             p.chmod(S_IWUSR)
-    rmtree(path, ignore_errors=True)
+
+    thread = None
+    if background and path.exists():
+        trash = path.parent / f".{path.name}.{os.getpid()}.{time.monotonic_ns()}.trash"
+        os.rename(path, trash)
+        thread = threading.Thread(target=_rmtree, args=(trash, workers))
+        thread.start()
+    elif workers:
+        _rmtree(path, workers)
+    else:
+        rmtree(path, ignore_errors=True)
     if path.exists():
         raise RuntimeError(f"cannot remove {path=}")
+    return thread
 
 
 def mkdir(path: Path) -> Path:
@@ -53,8 +122,33 @@ def touch(path: Path) -> Path:
     return path
 
 
+# directory -> (mtime_ns, names), see which
+_WHICH_CACHE: dict[str, tuple[int, set[str]]] = {}
+
+
+def which_cache_clear() -> None:
+    """drops the cached PATH directories listings"""
+    _WHICH_CACHE.clear()
+
+
+def _listdir(srcdir: str) -> set[str]:
+    try:
+        mtime = os.stat(srcdir).st_mtime_ns
+    except OSError:
+        return set()
+    if srcdir not in _WHICH_CACHE or _WHICH_CACHE[srcdir][0] != mtime:
+        try:
+            names = set(os.listdir(srcdir))
+        except OSError:
+            names = set()
+        if sys.platform == "win32":
+            names = {n.lower() for n in names}
+        _WHICH_CACHE[srcdir] = (mtime, names)
+    return _WHICH_CACHE[srcdir][1]
+
+
 @overload
-def which(exe: Path | str) -> list[Path]: ...
+def which(exe: Path | str) -> Path | None: ...
 
 
 @overload
@@ -66,79 +160,368 @@ def which(exe: Path | str, kind: None) -> Path | None: ...
 
 
 def which(exe: Path | str, kind: type[list] | None = None) -> list[Path] | Path | None:
+    """finds exe in PATH (trying the PATHEXT extensions)
+
+    The PATH directories listings are cached (and refreshed when their
+    mtime changes), so many lookups cost a single scan per directory.
+    """
+    exts = [e for e in os.environ.get("PATHEXT", "").split(os.pathsep) if e]
+    if not exts or Path(exe).suffix.lower() in {e.lower() for e in exts}:
+        exts.insert(0, "")
+    names = [f"{Path(exe).name}{ext}" for ext in exts]
+
+    if Path(exe).name != str(exe):
+        srcdirs = [str(Path(exe).parent)]
+    else:
+        srcdirs = [d for d in os.environ.get("PATH", "").split(os.pathsep) if d]
+
     candidates: list[Path] = []
-    for srcdir in os.environ.get("PATH", "").split(os.pathsep):
-        for ext in os.environ.get("PATHEXT", "").split(os.pathsep):
-            path = srcdir / Path(exe).with_suffix(ext)
-            if not path.exists():
+    for srcdir in srcdirs:
+        listing = _listdir(srcdir)
+        for name in names:
+            key = name.lower() if sys.platform == "win32" else name
+            if key not in listing:
+                continue
+            path = Path(srcdir) / name
+            if path.is_dir() or not os.access(path, os.X_OK):
                 continue
             if kind is None:
                 return path
             candidates.append(path)
-    return candidates
-
-
-def loadmod(path: Path | str, suffix: str | None = "") -> types.ModuleType:
+    return candidates if kind is list else None
+
+
+def cachedir() -> Path:
+    """the per user makepyz cache directory"""
+    if sys.platform == "win32" and os.getenv("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]) / "makepyz" / "cache"
+    return Path(os.getenv("XDG_CACHE_HOME") or "~/.cache").expanduser() / "makepyz"
+
+
+class _CachedSourceLoader(SourceFileLoader):
+    # caches the bytecode under cachedir, for any file suffix
+    def __init__(self, fullname: str, path: str, cachedir: Path | None):
+        super().__init__(fullname, path)
+        self.cachedir = cachedir
+
+    def get_code(self, fullname: str | None = None) -> types.CodeType:
+        import hashlib
+        import marshal
+        from importlib.util import MAGIC_NUMBER
+
+        path = Path(self.path)
+        stat = path.stat()
+        header = (
+            MAGIC_NUMBER
+            + (0).to_bytes(4, "little")
+            + (int(stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, "little")
+            + (stat.st_size & 0xFFFFFFFF).to_bytes(4, "little")
+        )
+
+        cfile = None
+        if self.cachedir:
+            key = hashlib.sha256(str(path.absolute()).encode()).hexdigest()[:16]
+            tag = sys.implementation.cache_tag
+            cfile = self.cachedir / f"{path.name}-{key}.{tag}.pyc"
+            with contextlib.suppress(OSError, ValueError, EOFError, TypeError):
+                data = cfile.read_bytes()
+                if data[:16] == header:
+                    return marshal.loads(data[16:])
+
+        code = compile(path.read_bytes(), str(path), "exec", dont_inherit=True)
+        if cfile:
+            with contextlib.suppress(OSError):
+                tmp = mkdir(cfile.parent) / f"{cfile.name}.{os.getpid()}"
+                tmp.write_bytes(header + marshal.dumps(code))
+                os.replace(tmp, cfile)
+        return code
+
+
+def loadmod(
+    path: Path | str, suffix: str | None = "", cachedir: Path | None = None
+) -> types.ModuleType:
+    """loads path as a module (whatever its suffix is)
+
+    With a cachedir the compiled bytecode is stored there, keyed on the path,
+    size, mtime and interpreter version. suffix is kept for compatibility.
+    """
     import inspect
-    from importlib import machinery, util
+    from importlib import util
 
     if isinstance(path, str):
         if not Path(path).is_absolute():
             path = Path(inspect.stack()[1].filename).parent / path
         path = Path(path)
 
-    if suffix is not None:
-        machinery.SOURCE_SUFFIXES.append(suffix)
-    try:
-        spec = util.spec_from_file_location(Path(path).name, Path(path))
-        if not spec:
-            raise FileOSModuleNotFoundError(f"cannot find module for {path=}")
-        module = util.module_from_spec(spec)
-        if not spec.loader:
-            raise FileOSMInvalidModuleError(f"invalid module in {path=}")
-        spec.loader.exec_module(module)
-    finally:
-        if suffix is not None:
-            machinery.SOURCE_SUFFIXES.pop()
+    loader = _CachedSourceLoader(path.name, str(path), cachedir)
+    spec = util.spec_from_file_location(path.name, path, loader=loader)
+    if not spec:
+        raise FileOSModuleNotFoundError(f"cannot find module for {path=}")
+    module = util.module_from_spec(spec)
+    if not spec.loader:
+        raise FileOSMInvalidModuleError(f"invalid module in {path=}")
+    spec.loader.exec_module(module)
     return module
 
 
 ### FILE UTILITIES
 
 
+class _MMapFile(io.RawIOBase):
+    # mmap has a file like interface, but no seekable (until py3.13)
+    def __init__(self, mapped: mmap.mmap):
+        self.mapped = mapped
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.mapped.seek(offset, whence)  # type: ignore[arg-type]
+        return self.mapped.tell()
+
+    def tell(self) -> int:
+        return self.mapped.tell()
+
+    def read(self, size: int | None = -1) -> bytes:
+        return self.mapped.read(size)
+
+    def readinto(self, buffer) -> int:
+        data = self.mapped.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        self.mapped.close()
+        super().close()
+
+
+class ZArchive(Mapping[str, Union[str, bytes]]):
+    """lazy, read only, view of a zipfile/tarball (memory mapped)
+
+    Members are read only on access (and items restricts the visible ones),
+    with an encoding their content is decoded (dropping "\r"): undecodable
+    (binary) members are returned as bytes (zextract hides them).
+
+    Example:
+        with ZArchive("foobar.whl", encoding=None) as archive:
+            data = archive["foobar/__init__.py"]
+            for name, fp in archive.stream():
+                ...
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        items: list[str] | None = None,
+        encoding: str | None = "utf-8",
+    ):
+        self.path = Path(path)
+        self.selected = set(items) if items else None
+        self.encoding = encoding
+        self._stack: contextlib.ExitStack | None = None
+        self._zip: ZipFile | None = None
+        self._tar: TarFile | None = None
+        self._members: dict[str, Any] = {}
+
+    def open(self) -> ZArchive:
+        from tarfile import is_tarfile
+        from tarfile import open as taropen
+        from zipfile import ZipFile, is_zipfile
+
+        if self._stack:
+            return self
+        stack = contextlib.ExitStack()
+        fp = stack.enter_context(self.path.open("rb"))
+        buffer: IO[bytes] = fp
+        if self.path.stat().st_size:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = stack.enter_context(_MMapFile(mapped))  # type: ignore
+        members: dict[str, Any]
+        if is_zipfile(buffer):
+            self._zip = stack.enter_context(ZipFile(buffer))
+            members = {i.filename: i for i in self._zip.infolist() if not i.is_dir()}
+        elif buffer.seek(0) == 0 and is_tarfile(self.path):
+            self._tar = stack.enter_context(taropen(fileobj=buffer))
+            members = {m.name: m for m in self._tar.getmembers() if m.isfile()}
+        else:
+            stack.close()
+            raise FileOSError(f"not a zipfile/tarball {self.path}")
+        self._members = {
+            k: v
+            for k, v in members.items()
+            if self.selected is None or k in self.selected
+        }
+        self._stack = stack
+        return self
+
+    def close(self) -> None:
+        if self._stack:
+            self._stack.close()
+        self._stack = self._zip = self._tar = None
+
+    def __enter__(self) -> ZArchive:
+        return self.open()
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _fileobj(self, name: str) -> IO[bytes]:
+        self.open()
+        member = self._members[name]
+        if self._zip:
+            return self._zip.open(member)
+        assert self._tar  # noqa: S101
+        fp = self._tar.extractfile(member)
+        if not fp:
+            raise KeyError(name)
+        return fp
+
+    def _decode(self, name: str, data: bytes) -> str | bytes:
+        if not self.encoding:
+            return data
+        try:
+            return str(data, encoding=self.encoding).replace("\r", "")
+        except UnicodeDecodeError:
+            return data
+
+    def __getitem__(self, name: str) -> str | bytes:
+        with self._fileobj(name) as fp:
+            return self._decode(name, fp.read())
+
+    def __contains__(self, name: object) -> bool:
+        self.open()
+        return name in self._members
+
+    def __iter__(self) -> Iterator[str]:
+        self.open()
+        return iter(list(self._members))
+
+    def __len__(self) -> int:
+        self.open()
+        return len(self._members)
+
+    def stream(self) -> Iterator[tuple[str, IO[bytes]]]:
+        """iterates over the (name, fileobj) without buffering the content"""
+        for name in self:
+            with self._fileobj(name) as fp:
+                yield name, fp
+
+
 def zextract(
     path: Path | str, items: list[str] | None = None, encoding: str | None = "utf-8"
 ) -> dict[str, str | bytes]:
     """extracts from path (a zipfile/tarball) all data in a dictionary"""
-    from tarfile import TarFile, is_tarfile
-    from zipfile import ZipFile, is_zipfile
+    result: dict[str, str | bytes] = {}
+    with ZArchive(path, items, encoding) as archive:
+        for name in archive:
+            data = archive[name]
+            # undecodable members are left out
+            if not encoding or isinstance(data, str):
+                result[name] = data
+    return result
+
+
+def _crc32(path: Path) -> int:
+    from zlib import crc32
+
+    value = 0
+    with path.open("rb") as fp:
+        while chunk := fp.read(1024 * 1024):
+            value = crc32(chunk, value)
+    return value
+
+
+def _safepath(dst: Path, name: str) -> Path:
+    path = (dst / name).resolve()
+    if name.startswith(("/", "\\")) or not path.is_relative_to(dst):
+        raise FileOSError(f"unsafe path in archive '{name}'")
+    return path
+
+
+def unpack(path: Path | str, dst: Path | str, workers: int | None = None) -> list[Path]:
+    """extracts a zipfile/tarball under dst, returning the written files
+
+    Members escaping dst (absolute, .. or tar links) raise FileOSError, the
+    permissions are preserved and files already present with the same size
+    and crc (zip) or size and mtime (tar) are skipped. Zip members are
+    written by workers threads, tarballs are read sequentially.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from tarfile import is_tarfile
+    from tarfile import open as taropen
+    from zipfile import ZipFile, ZipInfo, is_zipfile
 
     path = Path(path)
-    result: dict[str, str | bytes] = {}
-    if is_tarfile(path):
-        with TarFile.open(path) as tfp:
-            for member in tfp.getmembers():
+    dst = mkdir(Path(dst)).resolve()
+    written: list[Path] = []
+
+    def copy(fp: IO[bytes], target: Path, mode: int | None) -> None:
+        mkdir(target.parent)
+        with target.open("wb") as out:
+            shutil.copyfileobj(fp, out, 1024 * 1024)
+        if mode:
+            target.chmod(mode)
+
+    if is_zipfile(path):
+        with ZipFile(path) as zfp:
+            infos = zfp.infolist()
+        for zinfo in infos:
+            _safepath(dst, zinfo.filename)
+
+        def process(chunk: list[ZipInfo]) -> list[Path]:
+            result = []
+            with ZipFile(path) as zfp:
+                for zinfo in chunk:
+                    target = _safepath(dst, zinfo.filename)
+                    if zinfo.is_dir():
+                        mkdir(target)
+                        continue
+                    if (
+                        target.exists()
+                        and target.stat().st_size == zinfo.file_size
+                        and _crc32(target) == zinfo.CRC
+                    ):
+                        continue
+                    mode = (zinfo.external_attr >> 16) & 0o7777
+                    with zfp.open(zinfo) as fp:
+                        copy(fp, target, mode if zinfo.create_system == 3 else None)
+                    result.append(target)
+            return result
+
+        n = workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            for out in pool.map(process, [infos[i::n] for i in range(n)]):
+                written.extend(out)
+    elif is_tarfile(path):
+        with taropen(path, "r|*") as tfp:
+            for member in tfp:
+                target = _safepath(dst, member.name)
+                if member.issym() or member.islnk():
+                    raise FileOSError(f"links are not supported '{member.name}'")
+                if member.isdir():
+                    mkdir(target)
+                    continue
+                if not member.isfile():
+                    continue
+                if target.exists():
+                    stat = target.stat()
+                    if (stat.st_size, int(stat.st_mtime)) == (
+                        member.size,
+                        member.mtime,
+                    ):
+                        continue
                 fp = tfp.extractfile(member)
                 if not fp:
                     continue
-                result[member.name] = str(fp.read(), encoding="utf-8")
-    elif is_zipfile(path):
-        with ZipFile(path) as tfp:
-            for zinfo in tfp.infolist():
-                if items and zinfo.filename not in items:
-                    continue
-                with tfp.open(zinfo.filename) as fp:
-                    data = fp.read()
-                    try:
-                        if encoding:
-                            out = str(data, encoding=encoding).replace("\r", "")
-                            result[zinfo.filename] = out
-                        else:
-                            result[zinfo.filename] = data
-                    except UnicodeDecodeError:
-                        pass
-
-    return result
+                copy(fp, target, member.mode & 0o7777)
+                os.utime(target, (member.mtime, member.mtime))
+                written.append(target)
+    else:
+        raise FileOSError(f"not a zipfile/tarball {path}")
+    return sorted(written)
 
 
 def backup(path: Path, ext: str, overwrite: bool = False, abort: bool = True) -> Path:
@@ -179,48 +562,303 @@ def mkstemp(**kwargs) -> Iterator[Path]:
         path.unlink()
 
 
-@contextlib.contextmanager
-def backups():
-    pathlist: list[Path | str] = []
-
-    def save(path: Path | str):
-        nonlocal pathlist
-        original = Path(path).expanduser().absolute()
-        backup = original.parent / f"{original.name}.bak"
-        if backup.exists():
-            raise RuntimeError("backup file present", backup)
-        shutil.copy(original, backup)
-        pathlist.append(backup)
-        return original
+def clone(src: Path, dst: Path) -> Path:
+    """copies src into dst (as a copy-on-write reflink if possible)
 
+    dst is written atomically: it is either missing or complete.
+    """
+    tmp = dst.parent / f"{dst.name}.{os.getpid()}.tmp"
     try:
-        yield save
+        cloned = False
+        if sys.platform == "linux":
+            import fcntl
+
+            ficlone = 0x40049409
+            with src.open("rb") as fp, tmp.open("wb") as out:
+                with contextlib.suppress(OSError):
+                    fcntl.ioctl(out.fileno(), ficlone, fp.fileno())
+                    cloned = True
+        if not cloned:
+            shutil.copyfile(src, tmp)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
     finally:
-        for backup in pathlist:
-            original = Path(backup).with_suffix("")
-            original.unlink()
-            shutil.move(Path(backup), original)
+        if tmp.exists():
+            tmp.unlink()
+    return dst
+
+
+class Backups:
+    """saves files (see backups) and restores them atomically"""
+
+    def __init__(self, ext: str = ".bak", workers: int | None = None):
+        self.ext = ext
+        self.workers = workers
+        self.pairs: list[tuple[Path, Path]] = []
+
+    def __call__(self, path: Path | str) -> Path:
+        return self.many([path])[0]
+
+    def many(self, paths: list[Path | str]) -> list[Path]:
+        """saves all paths (concurrently), returning their absolute paths"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        pairs = []
+        for path in paths:
+            original = Path(path).expanduser().absolute()
+            backup = original.parent / f"{original.name}{self.ext}"
+            if backup.exists():
+                raise RuntimeError("backup file present", backup)
+            pairs.append((original, backup))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(clone, *pair) for pair in pairs]
+        for pair, future in zip(pairs, futures):
+            if not future.exception():
+                self.pairs.append(pair)
+        for future in futures:
+            future.result()
+        return [original for original, _ in pairs]
+
+    def restore(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _ in pool.map(lambda p: os.replace(p[1], p[0]), self.pairs):
+                pass
+        self.pairs.clear()
 
 
-def check_call(*args, **kwargs):
-    """multiplatform check_call"""
+@contextlib.contextmanager
+def backups(ext: str = ".bak", workers: int | None = None) -> Iterator[Backups]:
+    """saves files and restores them on exit
+
+    Each file is cloned (see clone) into a sibling and put back with an
+    atomic os.replace, so the original is never missing or half written.
+
+    Example:
+        with backups() as save:
+            path = save("pyproject.toml")
+            paths = save.many(["a.txt", "b.txt"])
+    """
+    save = Backups(ext, workers)
+    try:
+        yield save
+    finally:
+        save.restore()
 
-    # this takes care of win/*nix fdifferences
+
+def _popen_kwargs(kwargs: dict[str, Any]) -> dict[str, Any]:
+    # this takes care of win/*nix differences: on *nix the environment is
+    # passed through untouched (no copy, None means inherit)
+    kwargs = kwargs.copy()
     shell = False
-    env = kwargs.get("env", os.environ).copy()
     if sys.platform == "win32":
-        epath = os.environ.get("PATH", "").split(os.pathsep)
+        env = dict(kwargs.get("env") or os.environ)
+        epath = env.get("PATH", "").split(os.pathsep)
         exedir = Path(sys.executable).parent / "Scripts"
         if str(exedir) not in epath:
             epath.insert(0, str(exedir))
         env["PATH"] = os.pathsep.join(str(e) for e in epath)
 
-        eext = os.environ.get("PATHEXT", "").split(os.pathsep)
+        eext = env.get("PATHEXT", "").split(os.pathsep)
         exeext = ".EXE"
         if exeext not in eext:
             eext.insert(0, str(exeext))
         env["PATHEXT"] = os.pathsep.join(str(e) for e in eext)
+        kwargs["env"] = env
         shell = True
     kwargs["shell"] = shell
-    kwargs["env"] = env
-    return subprocess.check_call(*args, **kwargs)
+    return kwargs
+
+
+def check_call(*args, **kwargs):
+    """multiplatform check_call"""
+    cmd = args[0] if args else kwargs.get("args", "")
+    cmd = cmd if isinstance(cmd, str) else " ".join(str(a) for a in cmd)
+    with trace.span(Path(cmd.partition(" ")[0]).name, "subprocess", cmd=cmd):
+        if _prefixed() and not {"stdout", "stderr"} & set(kwargs):
+            return _relayed_call(*args, **kwargs)
+        return subprocess.check_call(*args, **_popen_kwargs(kwargs))
+
+
+def _prefixed() -> bool:
+    # true while the task output is prefixed (see scheduler.prefixed)
+    from .scheduler import PrefixedStream
+
+    return isinstance(sys.stdout, PrefixedStream)
+
+
+def _relayed_call(
+    args: str | list[str | Path], timeout: float | None = None, **kwargs
+) -> int:
+    # check_call copying the child output to sys.stdout/sys.stderr
+    proc = subprocess.Popen(  # noqa: S603
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        errors="replace",
+        **_popen_kwargs(kwargs),
+    )
+
+    def pump(src: IO[str], dst: IO[str]) -> None:
+        for line in src:
+            dst.write(line)
+
+    readers = [
+        _thread(pump, proc.stdout, sys.stdout),
+        _thread(pump, proc.stderr, sys.stderr),
+    ]
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+        for stream in [proc.stdout, proc.stderr]:
+            if stream:
+                stream.close()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return 0
+
+
+def _thread(target, *args) -> threading.Thread:
+    # a started thread running in a copy of the caller context (eg. the
+    # current task name, see scheduler.current)
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(target, *args), daemon=True
+    )
+    thread.start()
+    return thread
+
+
+@dc.dataclass
+class RunResult:
+    args: list[str]
+    returncode: int
+    wall: float
+    cpu: float | None = None
+    maxrss: int | None = None
+    stdout: list[str] = dc.field(default_factory=list)
+    stderr: list[str] = dc.field(default_factory=list)
+
+    def __str__(self):
+        cpu = "N/A" if self.cpu is None else f"{self.cpu:.2f}s"
+        rss = "N/A" if self.maxrss is None else f"{self.maxrss / 2**20:.1f}MB"
+        return f"wall {self.wall:.2f}s, cpu {cpu}, max rss {rss}"
+
+
+def run(
+    args: list[str | Path],
+    timeout: float | None = None,
+    check: bool = True,
+    logger: logging.Logger | None = None,
+    level: int = logging.INFO,
+    maxlines: int = 200,
+    **kwargs,
+) -> RunResult:
+    """multiplatform subprocess runner, with output streaming and timings
+
+    stdout/stderr are logged line by line (to logger, at level) and only
+    their last maxlines are kept in the result, with the wall time and (on
+    *nix, using os.wait4) the child cpu time and peak rss in bytes.
+    A timeout kills the child and raises subprocess.TimeoutExpired, with
+    check a failure raises subprocess.CalledProcessError.
+    """
+    from collections import deque
+
+    logger = logger or log
+    cmd = [str(a) for a in args]
+    tag = Path(cmd[0]).name
+
+    t0 = time.monotonic()
+    proc = subprocess.Popen(  # noqa: S603
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        errors="replace",
+        **_popen_kwargs(kwargs),
+    )
+
+    buffers: dict[str, deque[str]] = {
+        "stdout": deque(maxlen=maxlines),
+        "stderr": deque(maxlen=maxlines),
+    }
+
+    def pump(name: str, stream: IO[str]) -> None:
+        for line in stream:
+            line = line.rstrip("\n")
+            buffers[name].append(line)
+            logger.log(level, "[%s] %s", tag, line)
+
+    readers = [
+        _thread(pump, "stdout", proc.stdout),
+        _thread(pump, "stderr", proc.stderr),
+    ]
+
+    expired = threading.Event()
+
+    def kill() -> None:
+        expired.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+
+    cpu = maxrss = None
+    try:
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            cpu = usage.ru_utime + usage.ru_stime
+            # linux reports KB, macos bytes
+            maxrss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        else:
+            proc.wait()
+        for reader in readers:
+            reader.join()
+    finally:
+        if timer:
+            timer.cancel()
+        for stream in [proc.stdout, proc.stderr]:
+            if stream:
+                stream.close()
+
+    result = RunResult(
+        cmd,
+        proc.returncode,
+        time.monotonic() - t0,
+        cpu,
+        maxrss,
+        list(buffers["stdout"]),
+        list(buffers["stderr"]),
+    )
+    logger.debug("%s completed (%s)", tag, result)
+    trace.record(
+        tag,
+        "subprocess",
+        t0,
+        result.wall,
+        cmd=" ".join(cmd),
+        returncode=result.returncode,
+        cpu=result.cpu,
+        maxrss=result.maxrss,
+    )
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(
+            cmd, timeout or 0, "\n".join(result.stdout), "\n".join(result.stderr)
+        )
+    if check and result.returncode:
+        raise subprocess.CalledProcessError(
+            result.returncode,
+            cmd,
+            "\n".join(result.stdout),
+            "\n".join(result.stderr),
+        )
+    return result
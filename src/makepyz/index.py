@@ -0,0 +1,303 @@
+"""a static index of the make.py tasks (found without executing it)
+
+The tasks are the module level functions decorated with (api.)task(...)
+and the NAME = (api.tasks.)add_task(function, ...) assignments; the help
+for the latter is looked up statically in the function module. Anything
+the scan cannot follow (eg. tasks imported from other modules) makes the
+index incomplete (scan returns None) and the caller should load the module
+instead.
+"""
+
+from __future__ import annotations
+
+import ast
+import dataclasses as dc
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from importlib.machinery import ModuleSpec
+
+log = logging.getLogger(__name__)
+
+VERSION = 3  # bump on cache format changes
+
+
+@dc.dataclass
+class TaskInfo:
+    name: str  # the task name
+    attribute: str  # the make.py module attribute
+    doc: str | None = None
+    depends: list[str] = dc.field(default_factory=list)
+    aliases: list[str] = dc.field(default_factory=list)
+
+
+class _Incomplete(Exception):
+    pass
+
+
+def _callname(node: ast.expr) -> str:
+    # foo.bar.task(...) -> "task"
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return ""
+
+
+def _dotted(node: ast.expr) -> list[str]:
+    # a.b.c -> ["a", "b", "c"]
+    if isinstance(node, ast.Attribute):
+        return [*_dotted(node.value), node.attr]
+    if isinstance(node, ast.Name):
+        return [node.id]
+    raise _Incomplete(f"not a dotted name at line {node.lineno}")
+
+
+def _info(name: str, attribute: str, doc: str | None, kwargs: dict) -> TaskInfo:
+    name = kwargs.get("name") or name
+    if kwargs.get("namespace"):
+        name = f"{kwargs['namespace']}:{name}"
+    depends = list(kwargs.get("depends") or [])
+    return TaskInfo(name, attribute, doc, depends, list(kwargs.get("aliases") or []))
+
+
+def _keywords(call: ast.Call) -> dict[str, Any]:
+    result = {}
+    for keyword in call.keywords:
+        if keyword.arg in {"name", "depends", "aliases", "namespace"}:
+            try:
+                result[keyword.arg] = ast.literal_eval(keyword.value)
+            except ValueError as exc:
+                raise _Incomplete(f"non literal {keyword.arg}=") from exc
+    return result
+
+
+def _imports(tree: ast.Module, package: str = "") -> dict[str, str]:
+    # maps the module level imported names to their dotted path
+    result = {}
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    result[alias.asname] = alias.name
+                else:
+                    result[alias.name.partition(".")[0]] = alias.name.partition(".")[0]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".")[: len(package.split(".")) - node.level + 1]
+                base = ".".join([*parts, *([base] if base else [])])
+            for alias in node.names:
+                result[alias.asname or alias.name] = f"{base}.{alias.name}"
+    return result
+
+
+def _spec(top: str) -> ModuleSpec | None:
+    # looked up in sys.path, not in sys.modules (a long running process can
+    # hold a module from elsewhere under the same name)
+    from importlib.machinery import PathFinder
+
+    try:
+        return PathFinder.find_spec(top)
+    except (ImportError, ValueError):
+        return None
+
+
+def _source(module: str) -> Path | None:
+    # the module source, found without importing its parents
+    top, *rest = module.split(".")
+    spec = _spec(top)
+    if not spec or not spec.origin:
+        return None
+    path = Path(spec.origin)
+    for part in rest:
+        if path.name != "__init__.py":
+            return None
+        base = path.parent / part
+        path = base / "__init__.py" if base.is_dir() else base.with_suffix(".py")
+    return path if path.suffix == ".py" and path.exists() else None
+
+
+def _lookup(dotted: str, sources: dict[str, int], depth: int = 0) -> str | None:
+    """the docstring of the function at dotted (module.[attr.]function)"""
+    parts = dotted.split(".")
+    # the longest module prefix with a source
+    for index in range(len(parts) - 1, 0, -1):
+        module = ".".join(parts[:index])
+        path = _source(module)
+        if not path:
+            continue
+        sources[str(path)] = path.stat().st_mtime_ns
+        tree = ast.parse(path.read_bytes(), str(path))
+        name, rest = parts[index], parts[index + 1 :]
+        for node in tree.body:
+            if (
+                isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and node.name == name
+                and not rest
+            ):
+                return ast.get_docstring(node)
+        package = module if path.name == "__init__.py" else module.rpartition(".")[0]
+        imported = _imports(tree, package)
+        if name in imported and depth < 8:
+            return _lookup(".".join([imported[name], *rest]), sources, depth + 1)
+        break
+    raise _Incomplete(f"cannot find {dotted}")
+
+
+def _stdlib(path: Path) -> bool:
+    import sysconfig
+
+    paths = sysconfig.get_paths()
+    return path.is_relative_to(paths["stdlib"]) and not any(
+        path.is_relative_to(paths[key]) for key in ["purelib", "platlib"]
+    )
+
+
+def _task(dotted: str, sources: dict[str, int], depth: int = 0) -> bool:
+    """true if dotted (module.[...]name) is, or might be, a makepyz task"""
+    parts = dotted.split(".")
+    for index in range(len(parts), 0, -1):
+        module = ".".join(parts[:index])
+        path = _source(module)
+        if not path:
+            continue
+        if index == len(parts) or _stdlib(path):
+            return False  # a module, or from the stdlib
+        sources[str(path)] = path.stat().st_mtime_ns
+        tree = ast.parse(path.read_bytes(), str(path))
+        name, rest = parts[index], parts[index + 1 :]
+        if rest:
+            raise _Incomplete(f"cannot follow {dotted}")
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if node.name == name:
+                    return any(_callname(d) == "task" for d in node.decorator_list)
+            elif isinstance(node, ast.Assign) and any(
+                isinstance(t, ast.Name) and t.id == name for t in node.targets
+            ):
+                return any(
+                    isinstance(c, ast.Call) and _callname(c) in {"task", "add_task"}
+                    for c in ast.walk(node.value)
+                )
+        package = module if path.name == "__init__.py" else module.rpartition(".")[0]
+        imported = _imports(tree, package)
+        if name in imported and depth < 8:
+            return _task(imported[name], sources, depth + 1)
+        raise _Incomplete(f"cannot find {dotted}")
+    # compiled and builtin modules hold no tasks
+    if parts[0] in sys.builtin_module_names or _spec(parts[0]):
+        return False
+    raise _Incomplete(f"cannot find {dotted}")
+
+
+def _check(node: ast.AST) -> None:
+    # tasks made in loops, conditionals, expressions ...
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call) and _callname(child) in {"task", "add_task"}:
+            raise _Incomplete(f"dynamic task at line {child.lineno}")
+
+
+def _scan(path: Path, sources: dict[str, int]) -> list[TaskInfo]:
+    tree = ast.parse(path.read_bytes(), str(path))
+    imported = _imports(tree)
+    result = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for decorator in node.decorator_list:
+                if _callname(decorator) != "task":
+                    continue
+                if not isinstance(decorator, ast.Call):
+                    raise _Incomplete(f"task decorator without () for {node.name}")
+                kwargs = _keywords(decorator)
+                result.append(
+                    _info(node.name, node.name, ast.get_docstring(node), kwargs)
+                )
+        elif (
+            isinstance(node, ast.Assign)
+            and isinstance(node.value, ast.Call)
+            and _callname(node.value) == "add_task"
+        ):
+            call = node.value
+            if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                raise _Incomplete(f"add_task not assigned to a name at {node.lineno}")
+            if not call.args:
+                raise _Incomplete(f"add_task without a function at {node.lineno}")
+            _check(call.args[0])
+            function = _dotted(call.args[0])
+            if function[0] not in imported:
+                raise _Incomplete(f"{function[0]} not imported at {node.lineno}")
+            doc = _lookup(".".join([imported[function[0]], *function[1:]]), sources)
+            result.append(_info(function[-1], node.targets[0].id, doc, _keywords(call)))
+        elif isinstance(node, ast.ImportFrom):
+            # the tasks bound by importing them are not indexed
+            for alias in node.names:
+                name = alias.asname or alias.name
+                if alias.name == "*" or _task(imported[name], sources):
+                    raise _Incomplete(f"imported task {name} at line {node.lineno}")
+        elif (
+            isinstance(node, ast.Assign)
+            and isinstance(node.value, (ast.Name, ast.Attribute))
+            and _dotted(node.value)[0] in imported
+        ):
+            dotted = [imported[_dotted(node.value)[0]], *_dotted(node.value)[1:]]
+            if _task(".".join(dotted), sources):
+                raise _Incomplete(f"task bound at line {node.lineno}")
+        else:
+            _check(node)
+    return sorted(result, key=lambda t: t.name)
+
+
+def scan(path: Path, cachedir: Path | None = None) -> list[TaskInfo] | None:
+    """the tasks in path (a make.py), None if they cannot be found statically
+
+    With cachedir the index is stored there and reused while path (and the
+    modules looked up for the help) are unchanged.
+    """
+    import hashlib
+
+    path = path.absolute()
+    cfile = None
+    if cachedir:
+        key = hashlib.sha256(str(path).encode()).hexdigest()[:16]
+        cfile = cachedir / f"{path.name}-{key}.json"
+        try:
+            data = json.loads(cfile.read_text())
+            if data["version"] == VERSION and all(
+                os.stat(name).st_mtime_ns == mtime
+                for name, mtime in data["sources"].items()
+            ):
+                if data["tasks"] is None:
+                    return None
+                return [TaskInfo(**task) for task in data["tasks"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    sources = {str(path): path.stat().st_mtime_ns}
+    try:
+        found: list[TaskInfo] | None = _scan(path, sources)
+    except (_Incomplete, SyntaxError) as exc:
+        log.debug("cannot index %s: %s", path, exc)
+        found = None
+
+    if cfile:
+        data = {
+            "version": VERSION,
+            "sources": sources,
+            "tasks": None if found is None else [dc.asdict(t) for t in found],
+        }
+        try:
+            cfile.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cfile.with_name(f"{cfile.name}.{os.getpid()}")
+            tmp.write_text(json.dumps(data, indent=2))
+            os.replace(tmp, cfile)
+        except OSError:
+            pass
+    return found
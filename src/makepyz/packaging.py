@@ -1,45 +1,537 @@
 # All related to packaging
 from __future__ import annotations
 
+import contextlib
 import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
 import zipapp
+import zipfile
 from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, Callable
 
 from . import fileops
 
+if TYPE_CHECKING:
+    from zipfile import ZipFile
 
-def zhash(path: Path, encoding: str | None = "utf-8") -> dict[str, str]:
-    """extract a zip file in path"""
+log = logging.getLogger(__name__)
+
+BUFSIZE = 1024 * 1024
+MANIFEST_TAG = b"makepyz:"
+# zipimport can only read these
+COMPRESSIONS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+}
+ZIP_EPOCH = 315532800  # 1980-01-01, the earliest zip timestamp
+MAIN_TEMPLATE = """\
+# -*- coding: utf-8 -*-
+import {module}
+{module}.{fn}()
+"""
+
+
+class PackagingError(Exception):
+    pass
+
+
+def _digest(fp: IO[bytes], encoding: str | None) -> str:
+    # the members decoding as text are hashed without "\r"
+    import codecs
+
+    raw = hashlib.sha256()
+    text = hashlib.sha256() if encoding else None
+    if encoding:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        encoder = codecs.getincrementalencoder(encoding)()
+    while chunk := fp.read(BUFSIZE):
+        raw.update(chunk)
+        if text is not None:
+            try:
+                text.update(encoder.encode(decoder.decode(chunk).replace("\r", "")))
+            except UnicodeDecodeError:
+                text = None
+    if text is not None:
+        try:
+            tail = decoder.decode(b"", final=True).replace("\r", "")
+            text.update(encoder.encode(tail, final=True))
+        except UnicodeDecodeError:
+            text = None
+    return (raw if text is None else text).hexdigest()
+
+
+def zhash(
+    path: Path, encoding: str | None = "utf-8", workers: int = 0
+) -> dict[str, str]:
+    """sha256 of each member in a zipfile/tarball
+
+    Members are streamed in BUFSIZE chunks; with an encoding the members
+    decoding as text have their "\r" dropped (binary ones are hashed as
+    they are). Zip members can be hashed in parallel by workers threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from tarfile import is_tarfile
+    from tarfile import open as taropen
+    from zipfile import ZipFile, is_zipfile
+
+    result: dict[str, str] = {}
+    if is_tarfile(path):
+        with taropen(path, "r|*") as tfp:
+            for member in tfp:
+                fp = tfp.extractfile(member)
+                if fp:
+                    result[member.name] = _digest(fp, encoding)
+    elif is_zipfile(path):
+        with ZipFile(path) as zfp:
+            names = zfp.namelist()
+
+        def process(chunk: list[str]) -> dict[str, str]:
+            out = {}
+            with ZipFile(path) as zfp:
+                for name in chunk:
+                    with zfp.open(name) as fp:
+                        out[name] = _digest(fp, encoding)
+            return out
+
+        chunks = [names[i :: workers or 1] for i in range(workers or 1)]
+        with ThreadPoolExecutor(max_workers=workers or 1) as pool:
+            digests: dict[str, str] = {}
+            for out in pool.map(process, chunks):
+                digests.update(out)
+        result = {name: digests[name] for name in names}
+    return result
+
+
+def zsame(path1: Path, path2: Path, strict: bool = False) -> bool:
+    """compares two zipfiles members (name, size and crc)
+
+    The stored CRCs are a cheap pre-check that needs no decompression: with
+    strict the members sha256 are compared too if the CRCs match.
+    """
+    from zipfile import ZipFile
+
+    def crcs(path: Path) -> dict[str, tuple[int, int]]:
+        with ZipFile(path) as zfp:
+            return {z.filename: (z.CRC, z.file_size) for z in zfp.infolist()}
+
+    if crcs(path1) != crcs(path2):
+        return False
+    return zhash(path1, None) == zhash(path2, None) if strict else True
+
+
+def sha256(path: Path, cache: dict[str, Any] | None = None) -> str:
+    """sha256 of path content (cache maps path -> [mtime_ns, size, digest])"""
+    stat = path.stat()
+    key = str(path.absolute())
+    if cache is not None and cache.get(key, [])[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return cache[key][2]
+
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        while chunk := fp.read(BUFSIZE):
+            digest.update(chunk)
+    if cache is not None:
+        cache[key] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def manifest(
+    srcdir: Path,
+    filter: Callable[[Path], bool] | None = None,
+    cache: dict[str, Any] | None = None,
+) -> dict[str, str]:
+    """maps the srcdir files (as zipapp would pick them) to their sha256"""
     result = {}
-    for key, data in fileops.zextract(path, encoding=encoding).items():
-        if isinstance(data, str):
-            binary = data.encode(encoding or "utf-8")
-        else:
-            binary = data
+    for path in sorted(srcdir.rglob("*")):
+        arcname = path.relative_to(srcdir)
+        if path.is_dir() or (filter and not filter(arcname)):
+            continue
+        result[arcname.as_posix()] = sha256(path, cache)
+    return result
+
+
+def manifest_hash(data: dict[str, str], *args, **kwargs) -> str:
+    """a single hash for a manifest and the archive build arguments"""
+    digest = hashlib.sha256()
+    digest.update(repr((args, sorted(kwargs.items()))).encode("utf-8"))
+    for key, value in sorted(data.items()):
+        digest.update(f"{key}:{value}\n".encode())
+    return digest.hexdigest()
+
+
+def zmanifest(path: Path) -> str | None:
+    """returns the manifest hash embedded in the archive comment"""
+    from zipfile import BadZipFile, ZipFile
+
+    if not path.exists():
+        return None
+    with contextlib.suppress(BadZipFile), ZipFile(path) as zfp:
+        if zfp.comment.startswith(MANIFEST_TAG):
+            return zfp.comment[len(MANIFEST_TAG) :].decode("ascii")
+    return None
+
+
+def source_date_epoch() -> tuple[int, int, int, int, int, int]:
+    """the zip timestamp for all entries (from SOURCE_DATE_EPOCH)"""
+    epoch = max(int(os.getenv("SOURCE_DATE_EPOCH", "0") or 0), ZIP_EPOCH)
+    return time.gmtime(epoch)[:6]
+
 
-        result[key] = hashlib.sha256(binary).hexdigest()
+def pycompile(data: bytes, filename: str, optimize: int = -1) -> bytes:
+    """compiles data into an (unchecked hash based) .pyc
+
+    zipimport cannot write bytecode caches, but it will load a legacy .pyc
+    (mod.pyc next to mod.py) and it doesn't validate unchecked hash based
+    ones against the source timestamps.
+    """
+    import marshal
+    from importlib.util import MAGIC_NUMBER, source_hash
+
+    code = compile(data, filename, "exec", dont_inherit=True, optimize=optimize)
+    flags = (0b01).to_bytes(4, "little")
+    return MAGIC_NUMBER + flags + source_hash(data) + marshal.dumps(code)
+
+
+def _bytecode(
+    entries: dict[str, bytes | None], optimize: int | None, strip: bool
+) -> dict[str, bytes | None]:
+    if optimize is None:
+        return entries
+    result = entries.copy()
+    for arcname, data in entries.items():
+        if data is None or not arcname.endswith(".py"):
+            continue
+        result[f"{arcname}c"] = pycompile(data, arcname, optimize)
+        if strip:
+            del result[arcname]
     return result
 
 
-def makezapp(dst: Path, srcdir: Path, *args, **kwargs) -> Path | None:
-    def filter(path: Path) -> bool:
-        if "__pycache__" in str(path):
-            return False
-        if ".egg-info" in str(path):
-            return False
-        return True
+def compression(txt: str) -> tuple[int, int | None]:
+    """parses a METHOD[:LEVEL] string (eg. deflated:9) into zipfile values"""
+    method, _, level = txt.partition(":")
+    if method not in COMPRESSIONS:
+        raise PackagingError(
+            f"invalid compression '{method}' (one of {', '.join(COMPRESSIONS)})"
+        )
+    if level and not (level.isdigit() and 0 <= int(level) <= 9):
+        raise PackagingError(f"invalid compression level '{level}' (0-9)")
+    return COMPRESSIONS[method], int(level) if level else None
+
+
+def _zwrite(
+    zfp: ZipFile,
+    entries: dict[str, bytes | None],
+    method: int,
+    level: int | None = None,
+) -> None:
+    from zipfile import ZIP_STORED, ZipInfo
+
+    date_time = source_date_epoch()
+    for arcname, data in sorted(entries.items()):
+        mode = 0o100644 if data is not None else 0o40755
+        info = ZipInfo(arcname, date_time)
+        info.create_system = 3
+        info.external_attr = (mode << 16) | (0x10 if data is None else 0)
+        info.compress_type = method if data is not None else ZIP_STORED
+        zfp.writestr(info, data or b"", compresslevel=level)
+
+
+def create_archives(
+    source: Path,
+    targets: list[tuple[Path, str | None, bytes]],
+    interpreter: str | None = None,
+    filter: Callable[[Path], bool] | None = None,
+    compressed: bool = False,
+    optimize: int | None = None,
+    strip: bool = False,
+    workers: int | None = None,
+    extra: list[Path] | None = None,
+    compression: int | None = None,
+    compresslevel: int | None = None,
+) -> list[Path]:
+    """creates many zipapps from source, differing only in the __main__
+
+    targets is a list of (target, main, comment): the source tree is read,
+    compiled and compressed only once, and each target is the copy of it
+    with its own __main__ appended (written in parallel by workers threads).
+    The extra trees (eg. the vendored dependencies) are merged in source.
+    compression (a zipfile method) and compresslevel override compressed.
+    """
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
+    method = compression
+    if method is None:
+        method = ZIP_DEFLATED if compressed else ZIP_STORED
+
+    for _, main, _ in targets:
+        if main and (source / "__main__.py").exists():
+            raise zipapp.ZipAppError(
+                "cannot specify entry point if source has __main__.py"
+            )
+        if not main and not (source / "__main__.py").exists():
+            raise zipapp.ZipAppError("archive has no entry point")
+        mod, sep, fn = (main or "").partition(":")
+        # like zipapp, fn can be a dotted name (eg. pkg:obj.method)
+        names = [*mod.split("."), *fn.split(".")]
+        if main and not (sep and all(p.isidentifier() for p in names)):
+            raise zipapp.ZipAppError(f"invalid entry point: {main}")
+
+    entries: dict[str, bytes | None] = {}
+    for srcdir in [source, *(extra or [])]:
+        for path in srcdir.rglob("*"):
+            arcname = path.relative_to(srcdir)
+            if filter is None or filter(arcname):
+                if path.is_dir():
+                    entries.setdefault(arcname.as_posix() + "/", None)
+                else:
+                    entries.setdefault(arcname.as_posix(), path.read_bytes())
+
+    base = io.BytesIO()
+    if interpreter:
+        base.write(f"#!{interpreter}\n".encode(sys.getfilesystemencoding()))
+    with ZipFile(base, "w") as zfp:
+        _zwrite(zfp, _bytecode(entries, optimize, strip), method, compresslevel)
+
+    def process(target: Path, main: str | None, comment: bytes) -> Path:
+        buf = io.BytesIO(base.getvalue())
+        with ZipFile(buf, "a") as zfp:
+            if main:
+                mod, _, fn = main.partition(":")
+                data = MAIN_TEMPLATE.format(module=mod, fn=fn).encode()
+                main_entries = _bytecode({"__main__.py": data}, optimize, strip)
+                _zwrite(zfp, main_entries, method, compresslevel)
+            zfp.comment = comment
+
+        tmp = target.parent / f"{target.name}.tmp"
+        tmp.write_bytes(buf.getvalue())
+        if interpreter:
+            tmp.chmod(0o755)
+        os.replace(tmp, target)
+        return target
+
+    with ThreadPoolExecutor(max_workers=workers or len(targets) or 1) as pool:
+        return list(pool.map(lambda t: process(*t), targets))
+
+
+def create_archive(
+    source: Path,
+    target: Path,
+    interpreter: str | None = None,
+    main: str | None = None,
+    filter: Callable[[Path], bool] | None = None,
+    compressed: bool = False,
+    comment: bytes = b"",
+    optimize: int | None = None,
+    strip: bool = False,
+    compression: int | None = None,
+    compresslevel: int | None = None,
+) -> Path:
+    """deterministic zipapp.create_archive
+
+    Entries are sorted, with fixed timestamps (see source_date_epoch) and
+    normalised permissions, so the same inputs give a byte identical target.
+    With optimize (an optimization level, -1 is the interpreter one) the .py
+    files are compiled next to the sources (see pycompile), and strip drops
+    the sources leaving the archive usable only with the same interpreter.
+    """
+    return create_archives(
+        source,
+        [(target, main, comment)],
+        interpreter=interpreter,
+        filter=filter,
+        compressed=compressed,
+        optimize=optimize,
+        strip=strip,
+        compression=compression,
+        compresslevel=compresslevel,
+    )[0]
+
+
+def _filter(path: Path) -> bool:
+    if "__pycache__" in str(path):
+        return False
+    if ".egg-info" in str(path):
+        return False
+    return True
+
+
+def makezapps(
+    targets: list[tuple[Path, str | None]],
+    srcdir: Path,
+    cache: Path | None = None,
+    workers: int | None = None,
+    extra: list[Path] | None = None,
+    **kwargs,
+) -> list[Path | None]:
+    """creates the (dst, main) zipapps from srcdir, skipping the up to date ones
+
+    The srcdir manifest hash (see manifest_hash) is stored in the archive
+    comment, so an unchanged srcdir doesn't even open the archive members;
+    cache is an (optional) json file holding the file digests by mtime/size.
+    The stale targets are generated together (see create_archives), extra
+    trees are included too (see vendor).
+    """
     kwargs = kwargs.copy()
     if "filter" not in kwargs:
-        kwargs["filter"] = filter
-
-    generate = True
-    if dst.exists():
-        dst1 = dst.parent / f"{dst.name}.bak"
-        zipapp.create_archive(srcdir, dst1, *args, **kwargs)
-        generate = zhash(dst) != zhash(dst1)
-        dst1.unlink()
-
-    if generate:
-        zipapp.create_archive(srcdir, dst, *args, **kwargs)
-        return dst
+        kwargs["filter"] = _filter
+
+    digests: dict[str, Any] = {}
+    if cache and cache.exists():
+        with contextlib.suppress(ValueError):
+            digests = json.loads(cache.read_text())
+
+    options = {k: v for k, v in kwargs.items() if k != "filter"}
+    if kwargs.get("optimize") is not None:
+        from importlib.util import MAGIC_NUMBER
+
+        # the bytecode depends on the interpreter
+        options["magic"] = MAGIC_NUMBER.hex()
+    data = manifest(srcdir, kwargs["filter"], digests)
+    for path in extra or []:
+        for key, value in manifest(path, kwargs["filter"], digests).items():
+            data.setdefault(key, value)
+    if cache:
+        fileops.mkdir(cache.parent)
+        cache.write_text(json.dumps(digests, indent=2, sort_keys=True))
+
+    stale = []
+    for dst, main in targets:
+        current = manifest_hash(data, main=main, **options)
+        if zmanifest(dst) != current:
+            stale.append((dst, main, MANIFEST_TAG + current.encode("ascii")))
+    if stale:
+        create_archives(srcdir, stale, workers=workers, extra=extra, **kwargs)
+
+    generated = {dst for dst, _, _ in stale}
+    return [dst if dst in generated else None for dst, _ in targets]
+
+
+def makezapp(
+    dst: Path, srcdir: Path, *args, cache: Path | None = None, **kwargs
+) -> Path | None:
+    """creates the dst zipapp from srcdir (returns None if dst is up to date)
+
+    args are the zipapp.create_archive ones (interpreter, main, filter,
+    compressed), see makezapps.
+    """
+    kwargs = {
+        **dict(zip(["interpreter", "main", "filter", "compressed"], args)),
+        **kwargs,
+    }
+    main = kwargs.pop("main", None)
+    return makezapps([(dst, main)], srcdir, cache=cache, **kwargs)[0]
+
+
+def canonicalize(name: str) -> str:
+    """normalised distribution name (PEP 503)"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def wheels(wheeldirs: list[Path]) -> dict[str, Path]:
+    """maps the distribution names to the (latest) wheels found in wheeldirs"""
+
+    def key(path: Path) -> list[tuple[int, str]]:
+        version = path.name.split("-")[1]
+        return [
+            (int(p), "") if p.isdigit() else (-1, p) for p in re.split(r"[.+]", version)
+        ]
+
+    found: dict[str, list[Path]] = {}
+    for wheeldir in wheeldirs:
+        for path in wheeldir.rglob("*.whl"):
+            found.setdefault(canonicalize(path.name.split("-")[0]), []).append(path)
+    return {name: max(paths, key=key) for name, paths in found.items()}
+
+
+def _unwheel(wheel: Path, dst: Path) -> Path:
+    from zipfile import ZipFile
+
+    tmp = dst.parent / f"{dst.name}.tmp"
+    if tmp.exists():
+        fileops.rmtree(tmp)
+    with ZipFile(wheel) as zfp:
+        for zinfo in zfp.infolist():
+            name = zinfo.filename
+            parts = Path(name).parts
+            if zinfo.is_dir() or name.startswith("/") or ".." in parts:
+                continue
+            # zipimport cannot load the extensions modules
+            if name.endswith((".so", ".pyd")) or "__pycache__" in parts:
+                log.debug("skipping %s from %s", name, wheel.name)
+                continue
+            path = tmp / name
+            fileops.mkdir(path.parent)
+            with zfp.open(zinfo) as fp, path.open("wb") as out:
+                while chunk := fp.read(BUFSIZE):
+                    out.write(chunk)
+    os.replace(tmp, dst)
+    return dst
+
+
+def _requires(extracted: Path) -> list[str]:
+    from email.parser import Parser
+
+    result = []
+    for metadata in extracted.glob("*.dist-info/METADATA"):
+        message = Parser().parsestr(metadata.read_text(encoding="utf-8"))
+        for requirement in message.get_all("Requires-Dist") or []:
+            if "extra ==" in requirement.partition(";")[2]:
+                continue
+            result.append(requirement)
+    return result
+
+
+def vendor(
+    requirements: list[str], wheeldirs: list[Path], cachedir: Path
+) -> list[Path]:
+    """resolves the requirements (and their dependencies) from local wheels
+
+    Nothing is downloaded: the latest wheel found in wheeldirs is used
+    (version specifiers are not checked), extracted without the extensions
+    modules under cachedir and keyed by the wheel sha256, so the next
+    calls only reuse the extracted trees (to pass to makezapps extra).
+    """
+    available = wheels(wheeldirs)
+    digests: dict[str, Any] = {}
+    index = cachedir / "wheels.json"
+    if index.exists():
+        with contextlib.suppress(ValueError):
+            digests = json.loads(index.read_text())
+
+    result: list[Path] = []
+    seen: set[str] = set()
+    pending = list(requirements)
+    while pending:
+        requirement = pending.pop(0)
+        match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+        if not match:
+            raise PackagingError(f"invalid requirement '{requirement}'")
+        name = canonicalize(match.group(1))
+        if name in seen:
+            continue
+        seen.add(name)
+        if name not in available:
+            if ";" in requirement:
+                log.warning("skipping '%s' (no wheel available)", requirement)
+                continue
+            raise PackagingError(f"cannot find a wheel for '{requirement}'")
+
+        wheel = available[name]
+        dst = cachedir / f"{wheel.stem}-{sha256(wheel, digests)[:16]}"
+        if not dst.exists():
+            log.info("extracting %s", wheel.name)
+            _unwheel(wheel, fileops.mkdir(cachedir) / dst.name)
+        result.append(dst)
+        pending.extend(_requires(dst))
+
+    fileops.mkdir(cachedir)
+    index.write_text(json.dumps(digests, indent=2, sort_keys=True))
+    return result
@@ -0,0 +1,190 @@
+"""runs tasks respecting their dependencies (optionally in parallel)"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import dataclasses as dc
+import logging
+import sys
+import threading
+import time
+from typing import IO, Callable, Iterator
+
+from .tasks import TaskError
+
+log = logging.getLogger(__name__)
+
+# the name of the task running in the current thread
+current: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "makepyz_task", default=None
+)
+
+
+@dc.dataclass
+class TaskResult:
+    name: str
+    status: str = "pending"  # pending|running|completed|failed|skipped
+    start: float = 0.0  # time.monotonic()
+    elapsed: float = 0.0
+    error: BaseException | None = None
+
+
+class PrefixedStream:
+    """a stream adding the current task name to each line written"""
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.buffers: dict[str, str] = {}
+
+    def write(self, txt: str) -> int:
+        name = current.get()
+        if name is None:
+            return self.stream.write(txt)
+        with self.lock:
+            data = self.buffers.pop(name, "") + txt
+            *lines, rest = data.split("\n")
+            for line in lines:
+                self.stream.write(f"[{name}] {line}\n")
+            if rest:
+                self.buffers[name] = rest
+        return len(txt)
+
+    def flush(self) -> None:
+        with self.lock:
+            for name, rest in self.buffers.items():
+                self.stream.write(f"[{name}] {rest}\n")
+            self.buffers.clear()
+        self.stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class PrefixFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = current.get()
+        if name is not None and not getattr(record, "task", None):
+            record.task = name
+            record.msg = f"[{name}] {record.msg}"
+        return True
+
+
+@contextlib.contextmanager
+def prefixed() -> Iterator[None]:
+    """prefixes the stdout/stderr lines and log messages with the task name"""
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = PrefixedStream(stdout)
+    sys.stderr = PrefixedStream(stderr)
+    handlers = logging.getLogger().handlers
+    prefix = PrefixFilter()
+    for handler in handlers:
+        handler.addFilter(prefix)
+    try:
+        yield
+    finally:
+        for handler in handlers:
+            handler.removeFilter(prefix)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def run(
+    graph: dict[str, list[str]],
+    order: list[str],
+    execute: Callable[[str], None],
+    jobs: int = 1,
+    keep_going: bool = False,
+) -> dict[str, TaskResult]:
+    """runs the tasks in order (see tasks.resolve) with jobs threads
+
+    A task starts once all its dependencies completed, a SystemExit with
+    a zero code counts as completed. On a failure no new task is started,
+    unless keep_going, where only the tasks depending on the failed one are
+    skipped; in both cases TaskError is raised at the end. With jobs=1 and
+    no keep_going exceptions (but SystemExit) propagate as they are.
+    """
+    from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+    results = {name: TaskResult(name) for name in order}
+
+    def process(name: str) -> None:
+        token = current.set(name)
+        t0 = results[name].start = time.monotonic()
+        results[name].status = "running"
+        try:
+            execute(name)
+            results[name].status = "completed"
+        except SystemExit as exc:
+            if exc.code:
+                results[name].status = "failed"
+                results[name].error = exc
+            else:
+                results[name].status = "completed"
+        except Exception as exc:
+            log.exception("task %s failed", name)
+            results[name].status = "failed"
+            results[name].error = exc
+        finally:
+            results[name].elapsed = time.monotonic() - t0
+            current.reset(token)
+
+    if jobs <= 1 and not keep_going:
+        for index, name in enumerate(order):
+            t0 = results[name].start = time.monotonic()
+            try:
+                execute(name)
+            except SystemExit as exc:
+                if exc.code:
+                    results[name].status = "failed"
+                    results[name].error = exc
+                    for skipped in order[index + 1 :]:
+                        results[skipped].status = "skipped"
+                    raise TaskError(f"failed task(s): {name}") from exc
+            finally:
+                results[name].elapsed = time.monotonic() - t0
+            results[name].status = "completed"
+        return results
+
+    pending = list(order)
+    running: dict[Future, str] = {}
+    stop = False
+    with contextlib.ExitStack() as stack:
+        if jobs > 1:
+            stack.enter_context(prefixed())
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(jobs, 1)))
+        while pending or running:
+            for name in list(pending):
+                deps = [results[d].status for d in graph.get(name, []) if d in results]
+                if any(s in {"failed", "skipped"} for s in deps):
+                    results[name].status = "skipped"
+                    pending.remove(name)
+                elif not stop and all(s == "completed" for s in deps):
+                    if len(running) >= max(jobs, 1):
+                        break
+                    # the workers see the caller contextvars (eg. a tracer)
+                    context = contextvars.copy_context()
+                    running[pool.submit(context.run, process, name)] = name
+                    pending.remove(name)
+            if stop and not running:
+                break
+            if not running:
+                if pending:
+                    raise TaskError(f"cannot schedule {', '.join(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if results[name].status == "failed" and not keep_going:
+                    stop = True
+
+    for name in pending:
+        if results[name].status == "pending":
+            results[name].status = "skipped"
+
+    failed = [name for name, r in results.items() if r.status == "failed"]
+    if failed:
+        raise TaskError(f"failed task(s): {', '.join(failed)}")
+    return results
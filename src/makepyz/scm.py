@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import dataclasses as dc
 import io
+import os
 import re
 import subprocess
 from pathlib import Path
@@ -268,6 +269,7 @@ class GitRepo(GitRepoBase):
             ],
         )
 
+        lookup_cache_clear()
         repo = self.__class__(workdir=workdir)
         repo(["config", "user.name", self(["config", "user.name"])])
         repo(["config", "user.email", self(["config", "user.email"])])
@@ -275,17 +277,136 @@ class GitRepo(GitRepoBase):
         return repo
 
 
-def lookup(path: Path | str) -> GitRepo | None:
-    cur = Path(path).absolute()
-    found = False
-    while not found and cur != cur.parent:
-        if (cur / ".git").exists():
-            return GitRepo(cur)
-        if str(cur) == cur.root:
+# directory -> ((workdir, gitdir) | None, directory mtime, next directory
+# looked into | None), see lookup
+_LOOKUP_CACHE: dict[
+    tuple[Path, str, str], tuple[tuple[Path, Path] | None, int | None, Path | None]
+] = {}
+_REPOS: dict[tuple[Path, Path], GitRepo] = {}
+
+
+def lookup_cache_clear() -> None:
+    """drops all the memoized lookup results"""
+    _LOOKUP_CACHE.clear()
+    _REPOS.clear()
+
+
+def _gitdir(path: Path) -> Path | None:
+    # path/.git can be a directory or a "gitdir: <path>" file (worktrees/submodules)
+    marker = path / ".git"
+    if marker.is_dir():
+        return marker
+    if marker.is_file():
+        txt = marker.read_text(encoding="utf-8").strip()
+        if txt.startswith("gitdir:"):
+            return (path / txt[len("gitdir:") :].strip()).absolute()
+    return None
+
+
+def _ceilings() -> set[Path]:
+    return {
+        Path(p).absolute()
+        for p in os.environ.get("GIT_CEILING_DIRECTORIES", "").split(os.pathsep)
+        if p.strip()
+    }
+
+
+def _repo(workdir: Path, gitdir: Path) -> GitRepo:
+    key = (workdir, gitdir)
+    if key not in _REPOS:
+        _REPOS[key] = GitRepo(workdir, gitdir=gitdir)
+    return _REPOS[key]
+
+
+def _mtime(path: Path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cached(cur: Path, env: tuple[str, str]) -> tuple[bool, tuple[Path, Path] | None]:
+    # (hit, found): a result holds while the directories looked into (up to
+    # where the search stopped) keep their mtime and the git dir is there
+    path: Path | None = cur
+    first = _LOOKUP_CACHE.get((cur, *env))
+    while path is not None:
+        entry = _LOOKUP_CACHE.get((path, *env))
+        if entry is None or entry[1] is None or _mtime(path) != entry[1]:
+            return False, None
+        path = entry[2]
+    found = first[0] if first else None
+    if found and not found[1].exists():
+        return False, None
+    return True, found
+
+
+def _discover(
+    cur: Path, ceilings: set[Path], env: tuple[str, str]
+) -> tuple[Path, Path] | None:
+    visited: list[tuple[Path, int | None]] = []
+    found: tuple[Path, Path] | None = None
+    hit = False
+    while cur != cur.parent:
+        hit, found = _cached(cur, env)
+        if hit:
+            break
+        # the mtime changes when a .git is added/removed
+        visited.append((cur, _mtime(cur)))
+        if gitdir := _gitdir(cur):
+            found = (cur, gitdir)
+            break
+        if cur.parent in ceilings:
             break
         cur = cur.parent
+    for index, (path, mtime) in enumerate(visited):
+        if index + 1 < len(visited):
+            following: Path | None = visited[index + 1][0]
+        else:
+            following = cur if hit else None
+        _LOOKUP_CACHE[(path, *env)] = (found, mtime, following)
+    return found
+
+
+def lookup(path: Path | str, cache: bool = True) -> GitRepo | None:
+    """finds the git repository containing path
+
+    It honours GIT_DIR (and GIT_WORK_TREE) and GIT_CEILING_DIRECTORIES, .git
+    files (worktrees/submodules) and results are memoized per directory: they
+    are dropped when a directory looked into changed (eg. git init) or the git
+    dir is gone, use lookup_cache_clear (or cache=False) to drop them all.
+    """
+    return lookup_many([path], cache=cache)[Path(path)]
+
+
+def lookup_many(
+    paths: list[Path | str], cache: bool = True
+) -> dict[Path, GitRepo | None]:
+    """finds the git repository for each path (sharing the ancestors lookups)"""
+    env = (
+        os.environ.get("GIT_DIR", ""),
+        os.environ.get("GIT_CEILING_DIRECTORIES", ""),
+    )
+    if not cache:
+        lookup_cache_clear()
+
+    result: dict[Path, GitRepo | None] = {}
+    if env[0]:
+        # GIT_DIR overrides any discovery
+        gitdir = Path(env[0]).absolute()
+        worktree = os.environ.get("GIT_WORK_TREE", "")
+        for path in paths:
+            workdir = Path(worktree or path).absolute()
+            if not worktree and gitdir.name == ".git":
+                workdir = gitdir.parent
+            result[Path(path)] = _repo(workdir, gitdir)
+        return result
 
-    return None
+    ceilings = _ceilings()
+    for path in paths:
+        found = _discover(Path(path).absolute(), ceilings, env)
+        result[Path(path)] = _repo(*found) if found else None
+    return result
 
 
 def clone(
@@ -303,4 +424,5 @@ def clone(
             ]
         ]
     )
+    lookup_cache_clear()
     return GitRepo(dest, exe)
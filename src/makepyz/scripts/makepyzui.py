@@ -1,13 +1,17 @@
+from __future__ import annotations
+
 import argparse
 import contextlib
 import functools
 import inspect
+import itertools
 import logging
+import os
 import sys
 import types
 from pathlib import Path
 
-from makepyz import cli, fileops, tasks
+from makepyz import cli, daemon, fileops, index, scheduler, tasks, trace, watch
 
 log = logging.getLogger(__name__)
 
@@ -18,59 +22,289 @@ def makepy():
     return fileops.loadmod(path)
 
 
-@cli.cli(parser_variables={"add_config": {"is-a-module": True}})
-def main(args: argparse.Namespace, mod: types.ModuleType):
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="run up to JOBS independent tasks in parallel",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-going",
+        action="store_true",
+        help="keep running the tasks not depending on a failed one",
+    )
+    parser.add_argument(
+        "-B",
+        "--always-make",
+        action="store_true",
+        help="run the tasks even if up to date",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="run the tasks again when their inputs change",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile the tasks (cProfile) into BUILDDIR/profile/TASK.prof",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        type=Path,
+        const=Path("makepyz-trace.json"),
+        help="write the tasks/subprocesses timings (Chrome trace events, "
+        "relative to BUILDDIR)",
+    )
+    format_help(parser)
+
+
+def usage(helps: dict[str, str | None]) -> str:
+    """the commands list (helps maps the task names to their doc)"""
+
+    def getdoc(doc):
+        return doc.strip().partition("\n")[0] if doc else "no help available"
+
+    txt = "\n".join(f"  {cmd} - {getdoc(doc)}" for cmd, doc in helps.items())
+    return f"""\
+make.py <command> [<command> ...] {{arguments}}
+
+Commands:
+{txt}
+"""
+
+
+def scan(config: Path) -> dict[str, str | None] | None:
+    """the config tasks help, from the static index (None if incomplete)"""
+    if not config.exists():
+        return None
+    found = index.scan(config, fileops.cachedir() / "index")
+    if found is None:
+        return None
+    helps = {task.name: task.doc for task in found}
+    if "info" not in helps:
+        helps = {"info": tasks.info.__doc__, **helps}
+    return helps
+
+
+def load_module(options: argparse.Namespace, arguments: list[str]) -> bool:
+    # the tasks are listed from the index, make.py is executed to run them
+    # (an unknown one shows the usage): the index can miss some tasks
+    return bool(arguments) or scan(options.config) is None
+
+
+def loader(path: Path) -> types.ModuleType:
+    """loads path (a make.py) registering its tasks in mod.__tasks__"""
+    registry = tasks.Registry(path)
+    try:
+        with tasks.registering(registry):
+            mod = fileops.loadmod(path, cachedir=fileops.cachedir() / "modules")
+        # the tasks imported from other modules
+        registry.adopt(vars(mod))
+    except tasks.TaskRegistryError as exc:
+        raise cli.AbortCliError(str(exc)) from exc
+    mod.__tasks__ = registry  # type: ignore
+    return mod
+
+
+def format_help(parser: argparse.ArgumentParser):
+    # appends the make.py commands to --help
+    original = parser.format_help
+
+    def _format_help():
+        helps = scan(daemon.configpath(sys.argv[1:]))
+        return original() + ("\n" + usage(helps) if helps else "")
+
+    parser.format_help = _format_help  # type: ignore
+
+
+@cli.cli(
+    add_arguments=add_arguments,
+    parser_variables={
+        "add_config": {
+            "is-a-module": True,
+            "load-module": load_module,
+            "loader": loader,
+        }
+    },
+)
+def main(args: argparse.Namespace, mod: types.ModuleType | None):
+    if mod is None:
+        print(usage(scan(args.config) or {}), file=sys.stderr)  # noqa: T201
+        raise cli.AbortExitNoTimingError()
     if not mod.__file__:
         raise RuntimeError(f"mo module path for {mod}")
-    tasks.BASEDIR = Path(mod.__file__).parent
+    basedir = tasks.BASEDIR = Path(mod.__file__).parent
+
+    registry = getattr(mod, "__tasks__", None)
+    if registry is None:
+        registry = tasks.Registry()
+        try:
+            registry.adopt(vars(mod))
+        except tasks.TaskRegistryError as exc:
+            raise cli.AbortCliError(str(exc)) from exc
 
-    names = [
-        k for k in dir(mod) if isinstance(getattr(getattr(mod, k), "task", None), str)
-    ]
     commands = {}
-    if "info" not in names:
+    declared = {}
+    graph = registry.graph()
+    if "info" not in registry:
         commands["info"] = tasks.info
+        graph["info"] = []
 
-    for name in names:
-        function = getattr(mod, name)
+    for name in sorted(registry):
+        function = declared[name] = registry[name].function
         if "mod" in inspect.signature(function).parameters:
             function = functools.partial(function, mod=mod)
-        commands[getattr(mod, name).task] = function
+        commands[name] = function
 
-    if not args.arguments or args.arguments[0] not in commands:
+    # the leading task names are the targets, the rest are the
+    # arguments for the last one: you can pass a `--` to avoid
+    # the main parser to catch them.
+    targets = []
+    while args.arguments and (
+        args.arguments[0] in commands or args.arguments[0] in registry
+    ):
+        targets.append(registry.name(args.arguments.pop(0)))
+    with contextlib.suppress(ValueError):
+        del args.arguments[args.arguments.index("--")]
 
-        def getdoc(fn):
-            return (
-                fn.__doc__.strip().partition("\n")[0]
-                if fn.__doc__
-                else "no help available"
-            )
+    if not targets:
+        helps = {cmd: fn.__doc__ for cmd, fn in commands.items()}
+        print(usage(helps), file=sys.stderr)  # noqa: T201
+        raise cli.AbortExitNoTimingError()
 
-        txt = "\n".join(f"  {cmd} - {getdoc(fn)}" for cmd, fn in commands.items())
-        print(  # noqa: T201
-            f"""\
-make.py <command> {{arguments}}
+    try:
+        order = tasks.resolve(graph, targets)
+    except tasks.TaskError as exc:
+        raise cli.AbortWrongArgumentError(str(exc)) from exc
 
-Commands:
-{txt}
-""",
-            file=sys.stderr,
-        )
-        raise cli.AbortExitNoTimingError()
+    # the tasks declaring inputs are skipped if these didn't change
+    state = tasks.TaskState(Path(mod.BUILDDIR) / "makepyz-state.json")
+    cache = tasks.TaskCache(fileops.cachedir() / "outputs")
+
+    workdir = Path.cwd()
+
+    # each task runs once, only the last target gets the arguments
+    def execute(name: str):
+        ctx = tasks.Context(basedir, Path(mod.BUILDDIR), workdir, name=name)
+        with tasks.using(ctx), trace.span(name, "task"):
+            if not args.profile:
+                process(name)
+                return
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(process, name)
+            finally:
+                path = ctx.build("profile", f"{name}.prof")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(path)
+                log.info("profile for %s in %s", name, path)
+
+    def process(name: str):
+        arguments = args.arguments if name == targets[-1] else []
+        key = None
+        if name in declared:
+            key = state.fingerprint(declared[name], arguments, basedir)
+            if not args.always_make and state.uptodate(declared[name], key, basedir):
+                print(f"makepyz: '{name}' is up to date.", file=sys.stderr)  # noqa: T201
+                return
+
+        # the cached outputs replace a run (unless forced with -B)
+        ckey = None
+        if key and getattr(declared[name], "cache", False):
+            ckey = cache.key(declared[name], key)
+            if not args.always_make and cache.restore(ckey, basedir) is not None:
+                print(f"makepyz: '{name}' restored from cache.", file=sys.stderr)  # noqa: T201
+                state.record(name, key)
+                return
+
+        if len(order) > 1:
+            log.info("running task %s", name)
+        try:
+            call(commands[name], arguments)
+        except SystemExit as exc:
+            # sys.exit(0) completes the task, the others still run
+            if exc.code:
+                raise
+        success(name, key, ckey)
+
+    def success(name: str, key: str | None, ckey: str | None):
+        state.record(name, key)
+        if ckey:
+            cache.store(ckey, declared[name], basedir)
+
+    # cProfile allows a single active profiler (python 3.12+)
+    if args.profile and args.jobs > 1:
+        log.warning("--profile runs the tasks sequentially")
+        args.jobs = 1
+
+    # tasks should use their context, the (single) chdir is for the
+    # ones still relying on the cwd
+    def run(names: list[str]):
+        tracer = trace.Tracer()
+        try:
+            os.chdir(basedir)
+            with trace.tracing(tracer):
+                scheduler.run(graph, names, execute, args.jobs, args.keep_going)
+        except tasks.TaskError as exc:
+            # the failures are already logged (see scheduler.run)
+            raise cli.AbortCliError(str(exc)) from exc
+        finally:
+            os.chdir(workdir)
+            state.save()
+            if len(names) > 1:
+                for name, elapsed in tracer.summary():
+                    log.info("%8.2fs %s", elapsed, name)
+            if args.trace:
+                path = tracer.write(Path(mod.BUILDDIR) / args.trace)
+                log.info("trace written in %s", path)
+
+    if not args.watch:
+        run(order)
+        return
+
+    inputs = {
+        name: registry[name].inputs
+        for name in order
+        if name in registry and registry[name].inputs
+    }
+    if not inputs:
+        raise cli.AbortWrongArgumentError("--watch needs tasks declaring inputs")
+
+    # make.py stays loaded, only the tasks affected by a change run again
+    # the tasks outputs are not changes (unless written by someone else)
+    outputs = [p for name in order if name in registry for p in registry[name].outputs]
+    rounds = itertools.chain([None], watch.watch(inputs, basedir, outputs=outputs))
+    with contextlib.suppress(KeyboardInterrupt):
+        for changed in rounds:
+            names = order if changed is None else watch.affected(graph, order, changed)
+            try:
+                run(names)
+            except (Exception, SystemExit) as exc:
+                log.error("failed %s: %s", ", ".join(names), exc)
+            print(f"makepyz: watching {len(inputs)} task(s)", file=sys.stderr)  # noqa: T201
 
-    # you can pass arguments to a command
-    # passing a `--` to avoid the main parser
-    # to catch them.
-    with contextlib.suppress(ValueError):
-        del args.arguments[args.arguments.index("--")]
 
-    command = commands[args.arguments[0]]
+def call(command, arguments: list[str]):
     sig = inspect.signature(command)
+    # ctx and workdir are passed by the task wrapper (see tasks.task)
+    sig = sig.replace(
+        parameters=[
+            p for p in sig.parameters.values() if p.name not in {"ctx", "workdir"}
+        ]
+    )
     kwargs = {}
     if "arguments" in sig.parameters:
-        kwargs["arguments"] = args.arguments[1:]
+        kwargs["arguments"] = arguments
     ba = sig.bind(**kwargs)
-    command(*ba.args, **ba.kwargs)
+    return command(*ba.args, **ba.kwargs)
 
 
 if __name__ == "__main__":
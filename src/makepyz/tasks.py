@@ -1,44 +1,459 @@
 from __future__ import annotations
 
+import contextlib
+import contextvars
+import dataclasses as dc
 import functools
 import inspect
 import json
+import logging
 import os
+import subprocess
 import sys
+import threading
 import types
 from pathlib import Path
+from typing import Any, Callable, Iterator
 
 from . import fileops
 
 BASEDIR: Path | None = None
 
 
-def task(name: str | None = None):
+class TaskError(Exception):
+    pass
+
+
+class TaskCycleError(TaskError):
+    pass
+
+
+class TaskRegistryError(TaskError):
+    pass
+
+
+@dc.dataclass
+class Context:
+    """where a task runs: tasks use it instead of the process cwd/environ
+
+    basedir is the make.py directory (the relative paths root) and workdir
+    the directory makepyz was started from.
+    """
+
+    basedir: Path
+    builddir: Path
+    workdir: Path = dc.field(default_factory=Path.cwd)
+    env: dict[str, str] = dc.field(default_factory=lambda: dict(os.environ))
+    name: str = ""
+    logger: logging.Logger | None = None
+
+    def __post_init__(self):
+        if self.logger is None:
+            suffix = f".{self.name}" if self.name else ""
+            self.logger = logging.getLogger(f"makepyz.tasks{suffix}")
+
+    def path(self, *parts: str | Path) -> Path:
+        """a path relative to basedir (absolute parts are kept)"""
+        return self.basedir.joinpath(*parts)
+
+    def build(self, *parts: str | Path) -> Path:
+        """a path relative to builddir"""
+        return self.builddir.joinpath(*parts)
+
+    def run(self, args: list[str | Path], **kwargs) -> fileops.RunResult:
+        """fileops.run in basedir with this env"""
+        kwargs.setdefault("cwd", self.basedir)
+        kwargs.setdefault("env", self.env)
+        kwargs.setdefault("logger", self.logger)
+        return fileops.run(args, **kwargs)
+
+    def check_call(self, args: list[str | Path], **kwargs):
+        """fileops.check_call in basedir with this env"""
+        kwargs.setdefault("cwd", self.basedir)
+        kwargs.setdefault("env", self.env)
+        return fileops.check_call(args, **kwargs)
+
+
+_CONTEXT: contextvars.ContextVar[Context | None] = contextvars.ContextVar(
+    "makepyz_context", default=None
+)
+
+
+def context() -> Context:
+    """the running task context (one from BASEDIR outside makepyz)"""
+    ctx = _CONTEXT.get()
+    if ctx is None:
+        from .cli import MODULE_VARIABLES
+
+        if not BASEDIR:
+            raise RuntimeError("BASEDIR not defined")
+        ctx = Context(BASEDIR, BASEDIR / MODULE_VARIABLES["BUILDDIR"])
+    return ctx
+
+
+@contextlib.contextmanager
+def using(ctx: Context) -> Iterator[Context]:
+    """sets ctx as the task context (for this thread)"""
+    token = _CONTEXT.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _CONTEXT.reset(token)
+
+
+@dc.dataclass
+class TaskSpec:
+    """a task metadata (see task)"""
+
+    name: str
+    function: Callable
+    depends: list[str] = dc.field(default_factory=list)
+    inputs: list[str] = dc.field(default_factory=list)
+    outputs: list[str] = dc.field(default_factory=list)
+    cache: bool = False
+    env: list[str] = dc.field(default_factory=list)
+    aliases: list[str] = dc.field(default_factory=list)
+    tags: list[str] = dc.field(default_factory=list)
+    namespace: str = ""
+
+    @property
+    def fullname(self) -> str:
+        return f"{self.namespace}:{self.name}" if self.namespace else self.name
+
+    @property
+    def doc(self) -> str | None:
+        return self.function.__doc__
+
+
+class Registry:
+    """the tasks by name (namespace:name) and alias
+
+    Tasks register at decoration time into the active registry (see
+    registering): a name or alias defined twice raises TaskRegistryError.
+    """
+
+    def __init__(self, path: Path | None = None):
+        # only the tasks defined in path (if given) are registered
+        self.path = path
+        self.tasks: dict[str, TaskSpec] = {}
+        self.aliases: dict[str, str] = {}
+
+    def add(self, spec: TaskSpec) -> TaskSpec:
+        if self.tasks.get(spec.fullname) is spec:
+            return spec
+        for key in [spec.fullname, *spec.aliases]:
+            if key in self.tasks or key in self.aliases:
+                other = self.tasks[self.aliases.get(key, key)].function
+                raise TaskRegistryError(
+                    f"duplicate task '{key}' ({_where(spec.function)} and "
+                    f"{_where(other)})"
+                )
+        self.tasks[spec.fullname] = spec
+        self.aliases.update((alias, spec.fullname) for alias in spec.aliases)
+        return spec
+
+    def adopt(self, namespace: dict[str, Any]) -> None:
+        """adds the tasks bound in namespace (eg. imported in make.py)"""
+        for value in list(namespace.values()):
+            spec = getattr(value, "spec", None)
+            if isinstance(spec, TaskSpec):
+                self.add(spec)
+
+    def name(self, key: str) -> str:
+        """the task name for key (a name or an alias)"""
+        return self.aliases.get(key, key)
+
+    def graph(self) -> dict[str, list[str]]:
+        """maps the tasks to their dependencies (see resolve)"""
+        return {
+            name: [self.name(d) for d in spec.depends]
+            for name, spec in self.tasks.items()
+        }
+
+    def __getitem__(self, key: str) -> TaskSpec:
+        return self.tasks[self.name(key)]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.tasks or key in self.aliases
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tasks)
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+
+def _where(function) -> str:
+    code = getattr(inspect.unwrap(function), "__code__", None)
+    return f"{code.co_filename}:{code.co_firstlineno}" if code else repr(function)
+
+
+_REGISTRY: contextvars.ContextVar[Registry | None] = contextvars.ContextVar(
+    "makepyz_registry", default=None
+)
+
+
+@contextlib.contextmanager
+def registering(registry: Registry) -> Iterator[Registry]:
+    """the tasks defined in the with block are added to registry"""
+    token = _REGISTRY.set(registry)
+    try:
+        yield registry
+    finally:
+        _REGISTRY.reset(token)
+
+
+def _register(spec: TaskSpec) -> None:
+    registry = _REGISTRY.get()
+    if registry is None:
+        return
+    if registry.path:
+        # only the tasks made in registry.path (not in the modules it
+        # imports): the first caller outside this module
+        frame = sys._getframe(1)
+        while frame.f_back and frame.f_globals is globals():
+            frame = frame.f_back
+        if frame.f_globals.get("__file__") != str(registry.path):
+            return
+    registry.add(spec)
+
+
+def task(
+    name: str | None = None,
+    depends: list[str] | None = None,
+    inputs: list[str] | None = None,
+    outputs: list[str] | None = None,
+    cache: bool = False,
+    env: list[str] | None = None,
+    aliases: list[str] | None = None,
+    tags: list[str] | None = None,
+    namespace: str | None = None,
+):
+    """decorates a makepyz task
+
+    The task gets its Context as ctx argument (or from context()), and
+    the makepyz starting directory as workdir. depends lists the tasks
+    (by name) to run before this one, inputs and outputs are globs
+    (relative to BASEDIR): a task with inputs is skipped when they are
+    unchanged since its last run and all outputs exist.
+    With cache the outputs are stored (see TaskCache) and restored instead
+    of running the task again, env lists the variables affecting them.
+    The task is named namespace:name (if given), can be run by any of its
+    aliases and tags are free form labels.
+    """
+
     def _fn(function):
         @functools.wraps(function)
         def _fn1(*args, **kwargs):
-            oldcd = Path.cwd()
-            try:
-                if not BASEDIR:
-                    raise RuntimeError("BASEDIR not defined")
-                os.chdir(BASEDIR)
+            # nested calls share the caller context
+            with using(context()) as ctx:
                 params = inspect.signature(function).parameters
                 if "workdir" in params:
-                    kwargs["workdir"] = oldcd
+                    kwargs["workdir"] = ctx.workdir
+                if "ctx" in params:
+                    kwargs["ctx"] = ctx
                 return function(*args, **kwargs)
-            finally:
-                os.chdir(oldcd)
 
-        _fn1.task = (  # type: ignore
-            name or (function.func if hasattr(function, "func") else function).__name__
+        spec = TaskSpec(
+            name or getattr(function, "__name__", None) or function.func.__name__,
+            _fn1,
+            list(depends or []),
+            list(inputs or []),
+            list(outputs or []),
+            cache,
+            list(env or []),
+            list(aliases or []),
+            list(tags or []),
+            namespace or "",
         )
+        _fn1.spec = spec  # type: ignore
+        _fn1.task = spec.fullname  # type: ignore
+        _fn1.depends = spec.depends  # type: ignore
+        _fn1.inputs = spec.inputs  # type: ignore
+        _fn1.outputs = spec.outputs  # type: ignore
+        _fn1.cache = cache  # type: ignore
+        _fn1.env = spec.env  # type: ignore
+        _register(spec)
         return _fn1
 
     return _fn
 
 
-def add_task(function, **kwargs):
-    return task()(functools.partial(function, **kwargs))
+def add_task(function, depends: list[str] | None = None, **kwargs):
+    """makes function a task (kwargs are the task or function arguments)"""
+    names = set(inspect.signature(task).parameters) - {"depends"}
+    options = {k: kwargs.pop(k) for k in list(kwargs) if k in names}
+    partial = functools.partial(function, **kwargs)
+    # keeps the function name and doc, and the partial signature
+    signature = inspect.signature(partial)
+    functools.update_wrapper(partial, function)
+    partial.__signature__ = signature  # type: ignore
+    return task(depends=depends, **options)(partial)
+
+
+def expand(patterns: list[str], basedir: Path) -> list[Path]:
+    """the files matching the glob patterns under basedir"""
+    found: set[Path] = set()
+    for pattern in patterns:
+        found.update(path for path in basedir.glob(pattern) if path.is_file())
+    return sorted(found)
+
+
+class TaskState:
+    """the fingerprints of the last successful run of each task
+
+    A fingerprint is the hash of the task inputs content, arguments,
+    source and env variables; the file digests are cached by mtime/size
+    so unchanged files are not read again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        self.files: dict[str, Any] = data.get("files", {})
+        self.tasks: dict[str, str] = data.get("tasks", {})
+        self.dirty = False
+
+    def fingerprint(self, function, arguments: list[str], basedir: Path) -> str | None:
+        """the function fingerprint (None if it has no inputs)"""
+        from . import packaging
+
+        if not getattr(function, "inputs", None):
+            return None
+        data = {
+            path.relative_to(basedir).as_posix(): packaging.sha256(path, self.files)
+            for path in expand(function.inputs, basedir)
+        }
+        env = {name: os.getenv(name) for name in getattr(function, "env", [])}
+        return packaging.manifest_hash(
+            data, function.task, arguments, source(function), env
+        )
+
+    def uptodate(self, function, key: str | None, basedir: Path) -> bool:
+        if key is None or self.tasks.get(function.task) != key:
+            return False
+        return all(
+            expand([pattern], basedir) for pattern in getattr(function, "outputs", [])
+        )
+
+    def record(self, name: str, key: str | None) -> None:
+        if key is None:
+            return
+        with self.lock:
+            self.tasks[name] = key
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        with self.lock:
+            data = json.dumps({"files": self.files, "tasks": self.tasks}, indent=2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(data)
+
+
+def resolve(graph: dict[str, list[str]], targets: list[str]) -> list[str]:
+    """returns targets and their dependencies in execution order
+
+    graph maps each task to the ones it depends on: every task appears
+    once, after its dependencies (targets order is kept where possible).
+    """
+    order: list[str] = []
+    state: dict[str, bool] = {}  # False: visiting, True: done
+
+    def visit(name: str, path: list[str]) -> None:
+        if state.get(name) is True:
+            return
+        if name not in graph:
+            raise TaskError(
+                f"unknown task '{name}'"
+                + (f" (required by '{path[-1]}')" if path else "")
+            )
+        if state.get(name) is False:
+            cycle = [*path[path.index(name) :], name]
+            raise TaskCycleError(f"dependency cycle: {' -> '.join(cycle)}")
+        state[name] = False
+        for dependency in graph[name]:
+            visit(dependency, [*path, name])
+        state[name] = True
+        order.append(name)
+
+    for target in targets:
+        visit(target, [])
+    return order
+
+
+def source(function) -> str:
+    """the task function source (with the add_task keyword arguments)"""
+    function = inspect.unwrap(function, stop=lambda f: isinstance(f, functools.partial))
+    keywords = {}
+    if isinstance(function, functools.partial):
+        keywords = function.keywords
+        function = function.func
+    try:
+        code = inspect.getsource(function)
+    except (OSError, TypeError):
+        code = function.__code__.co_code.hex()
+    return f"{code}\n{sorted(keywords.items())!r}"
+
+
+class TaskCache:
+    """a content addressed store of the task outputs
+
+    Entries are keyed by the task fingerprint (inputs and arguments, see
+    TaskState), its source code and the values of its env variables: they
+    don't depend on the checkout location, so they are shared across
+    branches and clones.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def key(self, function, fingerprint: str) -> str:
+        import hashlib
+
+        digest = hashlib.sha256()
+        digest.update(f"{fingerprint}\n{source(function)}\n".encode())
+        for name in sorted(getattr(function, "env", [])):
+            digest.update(f"{name}={os.getenv(name)!r}\n".encode())
+        return digest.hexdigest()
+
+    def restore(self, key: str, basedir: Path) -> list[Path] | None:
+        """copies the outputs stored under key into basedir"""
+        entry = self.path / key[:2] / key
+        try:
+            names = json.loads((entry / "manifest.json").read_text())
+        except (OSError, ValueError):
+            return None
+        if not all((entry / "files" / name).exists() for name in names):
+            return None
+        result = []
+        for name in names:
+            dst = basedir / name
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            result.append(fileops.clone(entry / "files" / name, dst))
+        return result
+
+    def store(self, key: str, function, basedir: Path) -> list[Path]:
+        """saves the function outputs (under basedir) with key"""
+        entry = self.path / key[:2] / key
+        names = []
+        for path in expand(function.outputs, basedir):
+            name = path.relative_to(basedir).as_posix()
+            dst = entry / "files" / name
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            fileops.clone(path, dst)
+            names.append(name)
+        # the manifest goes last: an entry without it is incomplete
+        manifest = entry / "manifest.json"
+        tmp = manifest.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(names, indent=2))
+        os.replace(tmp, manifest)
+        return [entry / "files" / name for name in names]
 
 
 def info(arguments: list[str], mod: types.ModuleType | None = None):
@@ -69,7 +484,7 @@ Hi!
         print(head.format(name=name, value=argument, sep=":"))
 
 
-def tests(arguments: list[str], mod: types.ModuleType, package: str = "makepyz"):
+def tests(arguments: list[str], package: str = "makepyz"):
     """run all tests"""
 
     # def parse_arguments(arguments: list[str]):
@@ -79,12 +494,11 @@ def tests(arguments: list[str], mod: types.ModuleType, package: str = "makepyz")
     #
     # options = parse_arguments(arguments)
 
-    builddir = mod.BUILDDIR
+    ctx = context()
+    builddir = ctx.builddir
 
-    workdir = Path.cwd()
-    env = os.environ.copy()
-    env["PYTHONPATH"] = str(Path.cwd() / "src")
-    fileops.check_call(
+    env = {**ctx.env, "PYTHONPATH": str(ctx.path("src"))}
+    result = ctx.run(
         [
             "pytest",
             "-vvs",
@@ -94,10 +508,25 @@ def tests(arguments: list[str], mod: types.ModuleType, package: str = "makepyz")
             f"html:{builddir / 'coverage'}",
             "--cov-report",
             f"json:{builddir / 'coverage.json'}",
-            str(workdir / "tests"),
+            str(ctx.path("tests")),
         ],
         env=env,
+        check=False,
     )
+    if result.returncode:
+        # the streamed output is hidden with -q, the failures should not be
+        logger = ctx.logger or logging.getLogger(__name__)
+        if not logger.isEnabledFor(logging.INFO):
+            for line in result.stdout + result.stderr:
+                logger.warning("[pytest] %s", line)
+        raise subprocess.CalledProcessError(
+            result.returncode,
+            result.args,
+            "\n".join(result.stdout),
+            "\n".join(result.stderr),
+        )
+
+    print(f"⏱️ pytest: {result}")
 
     data = json.loads((builddir / "coverage.json").read_text())
 
@@ -128,7 +557,8 @@ def tests(arguments: list[str], mod: types.ModuleType, package: str = "makepyz")
 
 def checks():
     """run code checks (ruff/mypy)"""
-    fileops.check_call(
+    ctx = context()
+    ctx.check_call(
         [
             "pre-commit",
             "run",
@@ -136,7 +566,7 @@ def checks():
             "ruff-format",
         ]
     )
-    fileops.check_call(
+    ctx.check_call(
         [
             "pre-commit",
             "run",
@@ -144,9 +574,9 @@ def checks():
             "ruff",
         ]
     )
-    fileops.check_call(["pre-commit", "run", "-a", "mypy"])
+    ctx.check_call(["pre-commit", "run", "-a", "mypy"])
 
 
 def fmt():
     """apply 'ruff check --fix'"""
-    fileops.check_call(["ruff", "check", "--fix", "src", "tests"])
+    context().check_call(["ruff", "check", "--fix", "src", "tests"])
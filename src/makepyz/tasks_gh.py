@@ -1,8 +1,6 @@
 import argparse
 import contextlib
 import logging
-import os
-import subprocess
 import sys
 from pathlib import Path
 from typing import Any
@@ -53,7 +51,7 @@ def process_init(
 
 def build(arguments: list[str], package: str = "makepyz"):
     """create beta and release packages for makepyz (only in github)"""
-    from . import cli, fileops, github
+    from . import cli, fileops, github, tasks
 
     global DRYRUN
 
@@ -64,22 +62,27 @@ def build(arguments: list[str], package: str = "makepyz"):
         return parser.parse_args(arguments)
 
     options = parse_arguments(arguments)
+    ctx = tasks.context()
 
-    if not os.getenv("GITHUB_DUMP"):
+    if not ctx.env.get("GITHUB_DUMP"):
         raise cli.AbortWrongArgumentError("no GITHUB_DUMP env defined")
 
     DRYRUN = options.dryrun
     release = options.mode == "release"
-    gdata = github.get_gdata(os.environ["GITHUB_DUMP"])
+    gdata = github.get_gdata(ctx.env["GITHUB_DUMP"])
 
     with contextlib.ExitStack() as stack:
         save = stack.enter_context(fileops.backups())
 
         # pyproject.toml
-        _, version, current = process_pyproject(save("pyproject.toml"), gdata, release)
+        _, version, current = process_pyproject(
+            save(ctx.path("pyproject.toml")), gdata, release
+        )
 
         # __init__.py
-        _ = process_init(save(f"src/{package}/__init__.py"), gdata, version, current)
+        _ = process_init(
+            save(ctx.path("src", package, "__init__.py")), gdata, version, current
+        )
 
         if not options.dryrun:
-            subprocess.check_call([sys.executable, "-m", "build"])  # noqa: S603
+            ctx.check_call([sys.executable, "-m", "build"])
@@ -0,0 +1,99 @@
+"""collects the task and subprocess timings (as Chrome trace events)"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import dataclasses as dc
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+# the tracer collecting the spans (None: not tracing)
+current: contextvars.ContextVar[Tracer | None] = contextvars.ContextVar(
+    "makepyz_tracer", default=None
+)
+
+
+@dc.dataclass
+class Span:
+    name: str
+    category: str  # task|subprocess|...
+    start: float  # time.monotonic()
+    elapsed: float
+    thread: int
+    args: dict[str, Any] = dc.field(default_factory=dict)
+
+
+class Tracer:
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.lock = threading.Lock()
+        self.spans: list[Span] = []
+
+    def add(self, name: str, category: str, start: float, elapsed: float, **args):
+        span = Span(name, category, start, elapsed, threading.get_native_id(), args)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def events(self) -> dict[str, Any]:
+        """the spans in the Chrome trace event format (chrome://tracing)"""
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": round((span.start - self.t0) * 1e6),
+                    "dur": round(span.elapsed * 1e6),
+                    "pid": pid,
+                    "tid": span.thread,
+                    "args": {k: str(v) for k, v in span.args.items()},
+                }
+                for span in sorted(self.spans, key=lambda s: s.start)
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def write(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.events(), indent=1))
+        return path
+
+    def summary(self, category: str = "task") -> list[tuple[str, float]]:
+        """the (name, elapsed) of the category spans, slowest first"""
+        spans = [s for s in self.spans if s.category == category]
+        return [(s.name, s.elapsed) for s in sorted(spans, key=lambda s: -s.elapsed)]
+
+
+@contextlib.contextmanager
+def tracing(tracer: Tracer | None = None) -> Iterator[Tracer]:
+    """collects the spans into tracer (a new one by default)"""
+    tracer = tracer or Tracer()
+    token = current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        current.reset(token)
+
+
+def record(name: str, category: str, start: float, elapsed: float, **args) -> None:
+    """adds a span to the current tracer (if any)"""
+    tracer = current.get()
+    if tracer is not None:
+        tracer.add(name, category, start, elapsed, **args)
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args) -> Iterator[None]:
+    """records the time spent in the with block"""
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        record(name, category, t0, time.monotonic() - t0, **args)
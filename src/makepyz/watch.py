@@ -0,0 +1,87 @@
+"""polls the task inputs for changes (see makepyz --watch)"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import threading
+from pathlib import Path
+from typing import Iterator
+
+log = logging.getLogger(__name__)
+
+
+def snapshot(patterns: list[str], basedir: Path) -> dict[str, tuple[int, int]]:
+    """maps the files matching patterns (under basedir) to their mtime/size"""
+    from .tasks import expand
+
+    result = {}
+    for path in expand(patterns, basedir):
+        with contextlib.suppress(FileNotFoundError):
+            stat = path.stat()
+            name = path.relative_to(basedir).as_posix()
+            result[name] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def affected(graph: dict[str, list[str]], order: list[str], changed: set[str]):
+    """the tasks in order that changed or depend on a changed one"""
+    result = set(changed)
+    # order has the dependencies first
+    for name in order:
+        if any(dependency in result for dependency in graph.get(name, [])):
+            result.add(name)
+    return [name for name in order if name in result]
+
+
+def watch(
+    inputs: dict[str, list[str]],
+    basedir: Path,
+    interval: float = 0.5,
+    debounce: float = 0.2,
+    stop: threading.Event | None = None,
+    outputs: list[str] | None = None,
+) -> Iterator[set[str]]:
+    """yields the names (inputs keys) whose input files changed
+
+    Bursts of changes are reported once, when the files are left unchanged
+    for debounce seconds. It polls every interval seconds, until stop.
+    The files matching outputs (globs) written while the caller handles a
+    report (eg. by the tasks) are not changes, any other file is.
+    """
+    from .tasks import expand
+
+    stop = stop or threading.Event()
+
+    def take():
+        return {name: snapshot(patterns, basedir) for name, patterns in inputs.items()}
+
+    def written() -> set[str]:
+        return {
+            p.relative_to(basedir).as_posix() for p in expand(outputs or [], basedir)
+        }
+
+    last = take()
+    while not stop.wait(interval):
+        current = take()
+        if current == last:
+            continue
+        while not stop.wait(debounce):
+            settled = take()
+            if settled == current:
+                break
+            current = settled
+        changed = {name for name in inputs if current[name] != last[name]}
+        last = current
+        if changed:
+            log.debug("changed inputs for: %s", ", ".join(sorted(changed)))
+            before = written()
+            yield changed
+            if outputs:
+                fresh = take()
+                for name in inputs:
+                    for path in before | written():
+                        if path in fresh[name]:
+                            last[name][path] = fresh[name][path]
+                        else:
+                            last[name].pop(path, None)
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from makepyz import daemon
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs unix sockets")
+
+MAKEPY = """
+import os
+from makepyz import api
+from helpers import who
+
+
+@api.task()
+def hello():
+    print(f"hello {os.getpid()} {who()}")
+
+
+@api.task()
+def slow(ctx):
+    import time
+
+    ctx.path("started").touch()
+    time.sleep(5)
+    ctx.path("finished").touch()
+
+
+@api.task()
+def fail():
+    raise api.AbortWrongArgumentError("bad")
+"""
+
+
+def test_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert daemon.configpath([]) == tmp_path / "make.py"
+    assert daemon.configpath(["-v", "-c", "x.py", "hello"]) == tmp_path / "x.py"
+    assert daemon.configpath(["--config=/a/b.py"]) == daemon.Path("/a/b.py")
+    assert daemon.socketpath(tmp_path / "a.py") != daemon.socketpath(tmp_path / "b.py")
+
+
+def test_serve(tmp_path, monkeypatch, capfd):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    config = tmp_path / "make.py"
+    config.write_text(MAKEPY)
+    # make.py imports from the PYTHONPATH
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "helpers.py").write_text(
+        "import os\n\n\ndef who():\n    return os.getenv('WHO')\n"
+    )
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path / "lib"))
+    path = tmp_path / "run" / "makepyz.sock"
+    argv = ["-c", str(config), "--build-dir", str(tmp_path / "build")]
+
+    assert daemon.request(path, [*argv, "hello"]) is None
+    process = daemon.spawn(config, path, idle=30)
+    try:
+        for _ in range(100):
+            if path.exists():
+                break
+            time.sleep(0.05)
+
+        monkeypatch.setenv("WHO", "world")
+        assert daemon.request(path, [*argv, "hello"]) == 0
+        out = capfd.readouterr().out
+        assert out == f"hello {process.pid} world\n"
+        assert process.pid != os.getpid()
+
+        # make.py changes are picked up
+        config.write_text(MAKEPY.replace("hello {", "hi {"))
+        assert daemon.request(path, [*argv, "hello"]) == 0
+        assert capfd.readouterr().out == f"hi {process.pid} world\n"
+
+        assert daemon.request(path, [*argv, "fail"]) == 2
+        assert "error: bad" in capfd.readouterr().err
+
+        # a client interrupted (Ctrl-C) stops its task
+        import signal
+        import subprocess
+
+        code = "import sys; from makepyz import daemon; from pathlib import Path; "
+        code += "sys.exit(daemon.request(Path(sys.argv[1]), sys.argv[2:]))"
+        client = subprocess.Popen(
+            [sys.executable, "-c", code, str(path), *argv, "slow"],
+            env={**os.environ, "PYTHONPATH": str(Path(daemon.__file__).parent.parent)},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            if (tmp_path / "started").exists():
+                break
+            time.sleep(0.05)
+        assert (tmp_path / "started").exists()
+        client.send_signal(signal.SIGINT)
+        assert client.wait(timeout=5) == 130
+        assert daemon.request(path, [*argv, "hello"]) == 0
+        assert capfd.readouterr().out == f"hi {process.pid} world\n"
+        assert not (tmp_path / "finished").exists()
+
+        assert daemon.request(path, [], stop=True) is None
+        assert process.wait(timeout=5) == 0
+        assert not path.exists()
+    finally:
+        process.kill()
+
+
+def test_untrusted(tmp_path):
+    import socket
+
+    rundir = tmp_path / "run"
+    rundir.mkdir(mode=0o700)
+    assert daemon._trusted(rundir)
+    (tmp_path / "link").symlink_to(rundir)
+    assert not daemon._trusted(tmp_path / "link")
+    assert not daemon._trusted(tmp_path / "missing")
+
+    # a server in a shared directory never gets the request
+    rundir.chmod(0o755)
+    assert not daemon._trusted(rundir)
+    path = rundir / "makepyz.sock"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(path))
+        server.listen()
+        assert daemon.request(path, ["hello"]) is None
+        server.settimeout(0.1)
+        pytest.raises(socket.timeout, server.accept)
+
+    left, right = socket.socketpair()
+    with left, right:
+        assert daemon._peeruid(left) in {None, os.getuid()}
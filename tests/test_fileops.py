@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 
@@ -16,6 +17,25 @@ def test_rmtree(tmp_path):
     assert target.parent.exists()
 
 
+def test_rmtree_parallel(tmp_path):
+    def populate(target):
+        for i in range(3):
+            for j in range(10):
+                fileops.touch(target / f"d{i}" / f"e{j}" / "file.txt")
+        return target
+
+    target = populate(tmp_path / "workers")
+    assert fileops.rmtree(target, workers=4) is None
+    assert not target.exists()
+
+    target = populate(tmp_path / "background")
+    thread = fileops.rmtree(target, background=True)
+    assert not target.exists()
+    assert thread
+    thread.join()
+    assert not list(tmp_path.glob("*.trash"))
+
+
 def test_mkdir(tmp_path):
     target = tmp_path / "abc"
     assert not target.exists()
@@ -45,6 +65,27 @@ def test_which():
     assert path[0] == fileops.which(exe)
 
 
+@pytest.mark.skipif(sys.platform == "win32", reason="needs posix permissions")
+def test_which_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    monkeypatch.delenv("PATHEXT", raising=False)
+
+    fileops.touch(tmp_path / "tool.sh")
+    assert fileops.which("tool.sh") is None
+    (tmp_path / "tool.sh").chmod(0o755)
+    assert fileops.which("tool.sh") == tmp_path / "tool.sh"
+
+    # a new file changes the directory mtime
+    assert fileops.which("tool2") is None
+    fileops.touch(tmp_path / "tool2").chmod(0o755)
+    os.utime(tmp_path, ns=(0, tmp_path.stat().st_mtime_ns + 1))
+    assert fileops.which("tool2") == tmp_path / "tool2"
+    assert fileops.which("tool2", kind=list) == [tmp_path / "tool2"]
+
+    fileops.which_cache_clear()
+    assert fileops.which(tmp_path / "tool2") == tmp_path / "tool2"
+
+
 def test_loadmod(tmp_path):
     path = fileops.touch(tmp_path / "blah")
     path.write_text("MYVAR = 99")
@@ -55,6 +96,28 @@ def test_loadmod(tmp_path):
     pytest.raises(FileNotFoundError, fileops.loadmod, tmp_path / "xyz")
 
 
+def test_loadmod_cache(tmp_path):
+    import marshal
+    from importlib import machinery
+
+    suffixes = machinery.SOURCE_SUFFIXES[:]
+    path = fileops.touch(tmp_path / "make.py")
+    path.write_text("MYVAR = 99")
+    cachedir = tmp_path / "cache"
+
+    assert fileops.loadmod(path, cachedir=cachedir).MYVAR == 99
+    assert machinery.SOURCE_SUFFIXES == suffixes
+    (cfile,) = cachedir.glob("make.py-*.pyc")
+
+    # the cached bytecode is used if path is unchanged
+    data = cfile.read_bytes()
+    cfile.write_bytes(data[:16] + marshal.dumps(compile("MYVAR = 1", "", "exec")))
+    assert fileops.loadmod(path, cachedir=cachedir).MYVAR == 1
+
+    path.write_text("MYVAR = 100")
+    assert fileops.loadmod(path, cachedir=cachedir).MYVAR == 100
+
+
 def test_zextract(resolver):
     ball = resolver.lookup("foobar-0.0.0-py3-none-any.whl")
     data = fileops.zextract(ball)
@@ -67,6 +130,74 @@ def test_zextract(resolver):
     )
 
 
+def test_zarchive(resolver, tmp_path):
+    ball = resolver.lookup("foobar-0.0.0.tar.gz")
+    name = "foobar-0.0.0/src/foobar/__init__.py"
+    with fileops.ZArchive(ball, items=[name], encoding=None) as archive:
+        assert list(archive) == [name]
+        assert archive[name].strip() == b'__version__ = "0.0.0"'
+
+    ball = resolver.lookup("foobar-0.0.0-py3-none-any.whl")
+    with fileops.ZArchive(ball) as archive:
+        assert "foobar/xyz.py" in archive
+        assert len(archive) == 7
+        for name, fp in archive.stream():
+            assert fp.read().replace(b"\r", b"") == archive[name].encode()
+    assert fileops.zextract(ball, items=["foobar/xyz.py"]) == {
+        "foobar/xyz.py": archive["foobar/xyz.py"]
+    }
+
+    pytest.raises(
+        fileops.FileOSError, fileops.ZArchive(fileops.touch(tmp_path / "x")).open
+    )
+
+    # binary members are bytes (and left out by zextract)
+    from zipfile import ZipFile
+
+    path = tmp_path / "data.zip"
+    with ZipFile(path, "w") as zfp:
+        zfp.writestr("text.txt", "hello\r\n")
+        zfp.writestr("data.bin", bytes([0xFF, 0xFE]))
+    with fileops.ZArchive(path) as archive:
+        assert len(archive) == 2
+        assert "data.bin" in archive and "missing" not in archive
+        assert dict(archive) == {"text.txt": "hello\n", "data.bin": b"\xff\xfe"}
+    assert fileops.zextract(path) == {"text.txt": "hello\n"}
+
+
+def test_unpack(resolver, tmp_path):
+    from zipfile import ZipFile, ZipInfo
+
+    ball = resolver.lookup("foobar-0.0.0-py3-none-any.whl")
+    paths = fileops.unpack(ball, tmp_path / "whl", workers=2)
+    assert len(paths) == 7
+    assert (tmp_path / "whl" / "foobar" / "xyz.py").exists()
+
+    # unchanged files are skipped
+    (tmp_path / "whl" / "foobar" / "xyz.py").write_text("changed")
+    assert fileops.unpack(ball, tmp_path / "whl") == [
+        tmp_path / "whl" / "foobar" / "xyz.py"
+    ]
+
+    ball = resolver.lookup("foobar-0.0.0.tar.gz")
+    assert fileops.unpack(ball, tmp_path / "tar")
+    assert not fileops.unpack(ball, tmp_path / "tar")
+
+    ball = tmp_path / "bad.zip"
+    with ZipFile(ball, "w") as zfp:
+        info = ZipInfo("bin/run.sh")
+        info.create_system = 3
+        info.external_attr = 0o100755 << 16
+        zfp.writestr(info, "echo")
+    fileops.unpack(ball, tmp_path / "zip")
+    assert (tmp_path / "zip" / "bin" / "run.sh").stat().st_mode & 0o777 == 0o755
+
+    with ZipFile(ball, "a") as zfp:
+        zfp.writestr("../escape.txt", "")
+    pytest.raises(fileops.FileOSError, fileops.unpack, ball, tmp_path / "zip")
+    assert not (tmp_path / "escape.txt").exists()
+
+
 def test_backup_unbackup(tmp_path):
     path = tmp_path / "anoter.test.txt"
     path.write_text("A brand new message")
@@ -83,3 +214,57 @@ def test_backup_unbackup(tmp_path):
     assert not bak.exists()
     pytest.raises(fileops.FileOSError, fileops.unbackup, path, ".original")
     assert path.read_text() == "A brand new message"
+
+
+def test_backups(tmp_path):
+    paths = [tmp_path / f"file{i}.txt" for i in range(4)]
+    for path in paths:
+        path.write_text(f"original {path.name}")
+
+    with fileops.backups(workers=2) as save:
+        assert save(paths[0]) == paths[0]
+        assert save.many(paths[1:]) == paths[1:]
+        pytest.raises(RuntimeError, save, paths[0])
+        for path in paths:
+            assert (tmp_path / f"{path.name}.bak").exists()
+            path.write_text("changed")
+
+    for path in paths:
+        assert path.read_text() == f"original {path.name}"
+        assert not (tmp_path / f"{path.name}.bak").exists()
+
+    assert fileops.clone(paths[0], tmp_path / "copy.txt").read_text() == (
+        "original file0.txt"
+    )
+
+
+def test_run(caplog):
+    import logging
+    import subprocess
+
+    code = "import sys; print('hello'); print('world', file=sys.stderr)"
+    with caplog.at_level(logging.INFO):
+        result = fileops.run([sys.executable, "-c", code], maxlines=1)
+    assert result.returncode == 0
+    assert result.stdout == ["hello"]
+    assert result.stderr == ["world"]
+    assert result.wall > 0
+    if sys.platform != "win32":
+        assert result.cpu is not None and result.maxrss
+    assert "hello" in caplog.text
+
+    result = fileops.run([sys.executable, "-c", "print(1); print(2)"], maxlines=1)
+    assert result.stdout == ["2"]
+
+    pytest.raises(
+        subprocess.CalledProcessError,
+        fileops.run,
+        [sys.executable, "-c", "raise SystemExit(3)"],
+    )
+    assert fileops.run([sys.executable, "-c", "raise SystemExit(3)"], check=False)
+    pytest.raises(
+        subprocess.TimeoutExpired,
+        fileops.run,
+        [sys.executable, "-c", "import time; time.sleep(10)"],
+        timeout=0.2,
+    )
@@ -0,0 +1,100 @@
+import sys
+
+from makepyz import index
+
+MAKEPY = '''
+from makepyz import api
+from makepyz import tasks as tt
+
+raise RuntimeError("never executed")
+
+
+@api.task(name="hello", depends=["b"])
+def a_hello():
+    """says hello
+
+    more text
+    """
+
+
+@api.task()
+def b():
+    pass
+
+
+@api.task(namespace="docs", aliases=["d"])
+def build():
+    pass
+
+
+checks = api.tasks.add_task(api.tasks.checks)
+tests = api.tasks.add_task(tt.tests, package="x", depends=["b"])
+'''
+
+
+def test_scan(tmp_path):
+    path = tmp_path / "make.py"
+    path.write_text(MAKEPY)
+
+    found = index.scan(path)
+    assert found == [
+        index.TaskInfo("b", "b", None, []),
+        index.TaskInfo("checks", "checks", "run code checks (ruff/mypy)", []),
+        index.TaskInfo("docs:build", "build", None, [], ["d"]),
+        index.TaskInfo("hello", "a_hello", "says hello\n\nmore text", ["b"]),
+        index.TaskInfo("tests", "tests", "run all tests", ["b"]),
+    ]
+
+    # the index is cached until make.py changes
+    cachedir = tmp_path / "cache"
+    assert index.scan(path, cachedir) == found
+    (cfile,) = cachedir.glob("make.py-*.json")
+    cfile.write_text(cfile.read_text().replace("says hello", "cached"))
+    assert index.scan(path, cachedir)[3].doc.startswith("cached")
+
+    path.write_text(MAKEPY + "\n# changed\n")
+    assert index.scan(path, cachedir) == found
+
+
+def test_scan_incomplete(tmp_path):
+    path = tmp_path / "make.py"
+    for code in [
+        "from makepyz import api\nfor n in 'ab':\n    api.tasks.add_task(f, name=n)",
+        "from makepyz import api\nhello = api.task()(print)",
+        "from makepyz import api\nN = 'x'\n@api.task(name=N)\ndef f(): pass",
+        "from makepyz import api\n@api.task\ndef f(): pass",
+        "from makepyz import api\nx = api.tasks.add_task(api.tasks.missing)",
+        "x = add_task(undefined)",
+        "def broken(:",
+    ]:
+        path.write_text(code)
+        assert index.scan(path, tmp_path / "cache") is None, code
+        assert index.scan(path, tmp_path / "cache") is None, code
+
+
+def test_scan_imported(tmp_path, monkeypatch):
+    from importlib import util
+
+    # a module loaded from elsewhere under the same name is not used
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "mytasks.py").write_text("X = 1\n")
+    spec = util.spec_from_file_location("mytasks", tmp_path / "other" / "mytasks.py")
+    monkeypatch.setitem(sys.modules, "mytasks", util.module_from_spec(spec))  # type: ignore
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "mytasks.py").write_text(
+        "from makepyz import api\n\n\n@api.task()\ndef lint():\n    pass\n\n\n"
+        "def helper():\n    pass\n\n\nchecks = api.tasks.add_task(helper)\n"
+    )
+    path = tmp_path / "make.py"
+    for code, complete in [
+        ("from pathlib import Path\nfrom makepyz import api, tasks", True),
+        ("from math import pi\nfrom os import path as p", True),
+        ("from mytasks import helper", True),
+        ("from mytasks import lint", False),
+        ("from mytasks import helper, checks as c", False),
+        ("import mytasks\nlint = mytasks.lint", False),
+        ("from mytasks import *", False),
+        ("from missing import lint", False),
+    ]:
+        path.write_text(code)
+        assert (index.scan(path) is not None) == complete, code
@@ -1,3 +1,10 @@
+import hashlib
+import json
+import os
+import zipapp
+
+import pytest
+
 from makepyz import packaging
 
 
@@ -13,3 +20,208 @@ def test_zhash(resolver):
         "support/scripter.py": "e763f376c92dfa5aad69154146bf506d"
         "11cc08da9fc3e24b5d7e1e9e6d755987",
     }
+    assert packaging.zhash(path, workers=3) == packaging.zhash(path)
+
+
+def test_zhash_binary(tmp_path):
+    from zipfile import ZipFile
+
+    path = tmp_path / "data.zip"
+    with ZipFile(path, "w") as zfp:
+        zfp.writestr("text.txt", "hello\r\nworld")
+        zfp.writestr("data.bin", bytes([0xFF, 0xFE, 0x0D]))
+    assert packaging.zhash(path) == {
+        "text.txt": hashlib.sha256(b"hello\nworld").hexdigest(),
+        "data.bin": hashlib.sha256(bytes([0xFF, 0xFE, 0x0D])).hexdigest(),
+    }
+    assert packaging.zhash(path, None)["text.txt"] == (
+        hashlib.sha256(b"hello\r\nworld").hexdigest()
+    )
+
+    path2 = tmp_path / "data2.zip"
+    with ZipFile(path2, "w") as zfp:
+        zfp.writestr("text.txt", "hello\r\nworld")
+        zfp.writestr("data.bin", bytes([0xFF, 0xFE, 0x0D]))
+    assert packaging.zsame(path, path2, strict=True)
+    with ZipFile(path2, "a") as zfp:
+        zfp.writestr("other.txt", "")
+    assert not packaging.zsame(path, path2)
+
+    # binary members differing only by "\r" bytes differ
+    path3 = tmp_path / "data3.zip"
+    with ZipFile(path3, "w") as zfp:
+        zfp.writestr("data.bin", bytes([0xFF, 0x0D, 0xFE]))
+    assert packaging.zhash(path3)["data.bin"] != packaging.zhash(path)["data.bin"]
+
+
+def test_makezapp(tmp_path):
+    srcdir = tmp_path / "src"
+    (srcdir / "foobar").mkdir(parents=True)
+    (srcdir / "foobar" / "__init__.py").write_text("VALUE = 1\n")
+    (srcdir / "foobar" / "__pycache__").mkdir()
+    (srcdir / "foobar" / "__pycache__" / "x.pyc").write_text("")
+
+    dst = tmp_path / "foobar.pyz"
+    cache = tmp_path / "build" / "cache.json"
+    assert packaging.makezapp(dst, srcdir, main="foobar:main", cache=cache) == dst
+    assert packaging.zmanifest(dst)
+    assert sorted(packaging.zhash(dst)) == [
+        "__main__.py",
+        "foobar/",
+        "foobar/__init__.py",
+    ]
+    assert str(srcdir / "foobar" / "__init__.py") in json.loads(cache.read_text())
+
+    mtime = dst.stat().st_mtime_ns
+    assert packaging.makezapp(dst, srcdir, main="foobar:main", cache=cache) is None
+    assert dst.stat().st_mtime_ns == mtime
+
+    # the build arguments are part of the manifest
+    assert packaging.makezapp(dst, srcdir, main="foobar:main2") == dst
+
+    (srcdir / "foobar" / "__init__.py").write_text("VALUE = 2\n")
+    assert packaging.makezapp(dst, srcdir, main="foobar:main2") == dst
+
+
+def test_create_archive(tmp_path, monkeypatch):
+    import subprocess
+    import sys
+    from zipfile import ZipFile
+
+    srcdir = tmp_path / "src"
+    (srcdir / "foobar").mkdir(parents=True)
+    (srcdir / "foobar" / "__init__.py").write_text("def main():\n    print(42)\n")
+
+    dst1 = packaging.create_archive(srcdir, tmp_path / "a.pyz", main="foobar:main")
+    os.utime(srcdir / "foobar" / "__init__.py", (0, 0))
+    dst2 = packaging.create_archive(srcdir, tmp_path / "b.pyz", main="foobar:main")
+    assert dst1.read_bytes() == dst2.read_bytes()
+    out = subprocess.check_output([sys.executable, str(dst1)], encoding="utf-8")
+    assert out.strip() == "42"
+
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1700000000")
+    dst2 = packaging.create_archive(srcdir, dst2, main="foobar:main")
+    assert dst1.read_bytes() != dst2.read_bytes()
+    with ZipFile(dst2) as zfp:
+        assert zfp.getinfo("foobar/__init__.py").date_time == (2023, 11, 14, 22, 13, 20)
+
+    pytest.raises(
+        zipapp.ZipAppError, packaging.create_archive, srcdir, dst2, main="foobar"
+    )
+
+    # a dotted function name, as in zipapp
+    (srcdir / "foobar" / "app.py").write_text(
+        "class App:\n    @staticmethod\n    def run():\n        print(43)\n"
+    )
+    dst3 = packaging.create_archive(
+        srcdir, tmp_path / "c.pyz", main="foobar.app:App.run"
+    )
+    out = subprocess.check_output([sys.executable, str(dst3)], encoding="utf-8")
+    assert out.strip() == "43"
+    for main in ["foobar:App.", "foobar:1x", "foobar.:main"]:
+        with pytest.raises(zipapp.ZipAppError, match="invalid entry point"):
+            packaging.create_archive(srcdir, dst3, main=main)
+
+
+def test_create_archive_bytecode(tmp_path):
+    import subprocess
+    import sys
+    from zipfile import ZipFile
+
+    srcdir = tmp_path / "src"
+    (srcdir / "foobar").mkdir(parents=True)
+    (srcdir / "foobar" / "__init__.py").write_text(
+        "def main():\n    assert False\n    print(__file__)\n"
+    )
+
+    dst = packaging.create_archive(
+        srcdir, tmp_path / "a.pyz", main="foobar:main", optimize=1, strip=True
+    )
+    with ZipFile(dst) as zfp:
+        assert zfp.namelist() == ["foobar/", "foobar/__init__.pyc", "__main__.pyc"]
+    out = subprocess.check_output([sys.executable, str(dst)], encoding="utf-8")
+    assert out.strip().endswith("__init__.pyc")
+
+
+def test_makezapps(tmp_path):
+    srcdir = tmp_path / "src"
+    (srcdir / "foobar").mkdir(parents=True)
+    (srcdir / "foobar" / "__init__.py").write_text("def main():\n    pass\n")
+
+    targets = [
+        (tmp_path / "a.pyz", "foobar:main"),
+        (tmp_path / "b.pyz", "foobar:main2"),
+    ]
+    assert packaging.makezapps(targets, srcdir) == [t[0] for t in targets]
+    assert packaging.makezapp(targets[0][0], srcdir, main="foobar:main") is None
+    assert packaging.makezapps(targets, srcdir) == [None, None]
+
+    # same layout as the single target build
+    dst = packaging.create_archive(
+        srcdir,
+        tmp_path / "c.pyz",
+        main="foobar:main2",
+        comment=packaging.MANIFEST_TAG
+        + packaging.zmanifest(targets[1][0]).encode("ascii"),
+        filter=packaging._filter,
+    )
+    assert dst.read_bytes() == targets[1][0].read_bytes()
+
+    targets[1][0].unlink()
+    assert packaging.makezapps(targets, srcdir) == [None, targets[1][0]]
+
+
+def test_vendor(tmp_path, datadir):
+    from zipfile import ZipFile
+
+    cachedir = tmp_path / "cache"
+    requirements = ["foobar>=0.0", "missing; python_version < '3'"]
+    paths = packaging.vendor(requirements, [datadir], cachedir)
+    assert [p.parent for p in paths] == [cachedir]
+    assert (paths[0] / "foobar" / "xyz.py").exists()
+
+    # cached by the wheel hash
+    mtime = paths[0].stat().st_mtime_ns
+    assert packaging.vendor(requirements, [datadir], cachedir) == paths
+    assert paths[0].stat().st_mtime_ns == mtime
+
+    pytest.raises(
+        packaging.PackagingError, packaging.vendor, ["missing"], [datadir], cachedir
+    )
+
+    srcdir = tmp_path / "src"
+    (srcdir / "app").mkdir(parents=True)
+    (srcdir / "app" / "__init__.py").write_text("def main():\n    pass\n")
+    dst = tmp_path / "app.pyz"
+    assert packaging.makezapps([(dst, "app:main")], srcdir, extra=paths) == [dst]
+    with ZipFile(dst) as zfp:
+        assert "foobar/xyz.py" in zfp.namelist()
+        assert "foobar-0.0.0.dist-info/METADATA" in zfp.namelist()
+
+
+def test_compression(tmp_path):
+    from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+    assert packaging.compression("stored") == (ZIP_STORED, None)
+    assert packaging.compression("deflated:9") == (ZIP_DEFLATED, 9)
+    pytest.raises(packaging.PackagingError, packaging.compression, "lzma")
+    pytest.raises(packaging.PackagingError, packaging.compression, "deflated:x")
+    pytest.raises(packaging.PackagingError, packaging.compression, "deflated:15")
+
+    srcdir = tmp_path / "src"
+    (srcdir / "foobar").mkdir(parents=True)
+    (srcdir / "foobar" / "__init__.py").write_text("def main():\n    pass\n" * 10)
+    sizes = {}
+    for setting in ["stored", "deflated:1", "deflated:9"]:
+        method, level = packaging.compression(setting)
+        dst = packaging.create_archive(
+            srcdir,
+            tmp_path / f"{setting}.pyz",
+            main="foobar:main",
+            compression=method,
+            compresslevel=level,
+        )
+        with ZipFile(dst) as zfp:
+            assert zfp.getinfo("foobar/__init__.py").compress_type == method
+        sizes[setting] = dst.stat().st_size
+    assert sizes["stored"] > sizes["deflated:1"] >= sizes["deflated:9"]
@@ -38,6 +38,45 @@ def test_lookup(git_project_factory, monkeypatch):
     assert str(repofound.workdir) == f"{repo.workdir}"
 
 
+def test_lookup_cache_and_gitfile(git_project_factory, monkeypatch):
+    repo = git_project_factory().create("0.0.0")
+    dstdir = repo.workdir / "a" / "b"
+    dstdir.mkdir(parents=True)
+
+    # memoized: same instance, shared across the bulk api
+    found = scm.lookup(dstdir)
+    assert found is scm.lookup(dstdir)
+    found = scm.lookup_many([dstdir, dstdir.parent, repo.workdir.parent])
+    assert found[dstdir] is found[dstdir.parent]
+    assert found[dstdir].workdir == repo.workdir
+    assert found[repo.workdir.parent] is None
+
+    # a .git file (eg. worktrees/submodules)
+    subdir = repo.workdir.parent / "worktree"
+    (subdir / "x").mkdir(parents=True)
+    (subdir / ".git").write_text(f"gitdir: {repo.gitdir}\n")
+    found = scm.lookup(subdir / "x", cache=False)
+    assert found and found.workdir == subdir
+    assert found.gitdir == repo.gitdir
+
+    # new repositories are found (the looked into directories changed)
+    newdir = repo.workdir.parent / "new"
+    (newdir / "y").mkdir(parents=True)
+    assert scm.lookup(newdir / "y") is None
+    subprocess.check_call(["git", "init", "-q", str(newdir)])
+    found = scm.lookup(newdir / "y")
+    assert found and found.workdir == newdir
+    assert scm.lookup(newdir / "y") is found
+
+    # stops at the ceiling
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(dstdir.parent))
+    assert scm.lookup(dstdir) is None
+
+    monkeypatch.setenv("GIT_DIR", str(repo.gitdir))
+    found = scm.lookup(repo.workdir.parent)
+    assert found and found.workdir == repo.workdir
+
+
 def test_basic_scm_operations(git_project_factory):
     repo = git_project_factory("test_check_version-repo").create("0.0.0")
     assert not repo.status()
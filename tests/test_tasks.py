@@ -0,0 +1,512 @@
+import inspect
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from makepyz import cli, tasks
+from makepyz.scripts import makepyzui
+
+MAKEPY = """
+from makepyz import api
+
+CALLS = []
+
+
+@api.task()
+def checks():
+    CALLS.append("checks")
+    print("checking")
+
+
+@api.task(depends=["checks"])
+def tests(arguments):
+    CALLS.append(("tests", arguments))
+
+
+@api.task(depends=["checks", "tests"])
+def pack(arguments):
+    CALLS.append(("pack", arguments))
+
+
+@api.task(inputs=["data/*.txt"], outputs=["out.txt"])
+def gen(arguments):
+    from pathlib import Path
+
+    CALLS.append(("gen", arguments))
+    data = "".join(p.read_text() for p in sorted(Path("data").glob("*.txt")))
+    Path("out.txt").write_text(data)
+
+
+@api.task(inputs=["data/*.txt"], outputs=["gen/*.txt"], cache=True, env=["GEN"])
+def cached(arguments):
+    import os
+    from pathlib import Path
+
+    CALLS.append(("cached", arguments))
+    Path("gen").mkdir(exist_ok=True)
+    for path in Path("data").glob("*.txt"):
+        text = path.read_text() + os.getenv("GEN", "")
+        (Path("gen") / path.name).write_text(text)
+
+
+@api.task(name="loop", depends=["loop2"])
+def loop():
+    pass
+
+
+@api.task(name="loop2", depends=["loop"])
+def loop2():
+    pass
+
+
+@api.task(namespace="docs", aliases=["d"], depends=["checks"], tags=["doc"])
+def build():
+    CALLS.append("docs:build")
+
+
+@api.task()
+def pre():
+    import sys
+
+    print("pre")
+    sys.exit(0)
+
+
+@api.task(depends=["pre"])
+def post():
+    print("post")
+
+
+@api.task()
+def sub(ctx):
+    import sys
+
+    from makepyz import fileops
+
+    fileops.check_call([sys.executable, "-c", "print('check_call')"])
+    ctx.run([sys.executable, "-c", "print('run')"])
+
+
+@api.task()
+def where(ctx, workdir):
+    import os
+
+    print(ctx.name, ctx.basedir == ctx.path(), workdir == ctx.workdir, os.getcwd())
+"""
+
+
+def test_resolve():
+    graph = {"a": [], "b": ["a"], "c": ["a", "b"], "d": []}
+    assert tasks.resolve(graph, ["c"]) == ["a", "b", "c"]
+    assert tasks.resolve(graph, ["d", "c", "b"]) == ["d", "a", "b", "c"]
+
+    pytest.raises(tasks.TaskError, tasks.resolve, {"a": ["x"]}, ["a"])
+    with pytest.raises(tasks.TaskCycleError, match="a -> b -> a"):
+        tasks.resolve({"a": ["b"], "b": ["a"]}, ["a"])
+
+
+def test_registry(tmp_path):
+    registry = tasks.Registry()
+    with tasks.registering(registry):
+
+        @tasks.task(namespace="ns", aliases=["a"], tags=["x"])
+        def first():
+            pass
+
+        def second(package, verbose=False):
+            """second task"""
+
+        task2 = tasks.add_task(second, depends=["a"], package="p")
+
+    assert list(registry) == ["ns:first", "second"]
+    assert registry["a"] is registry["ns:first"] is first.spec
+    assert "a" in registry and "first" not in registry
+    assert registry["a"].tags == ["x"]
+    assert registry.graph() == {"ns:first": [], "second": ["ns:first"]}
+
+    # add_task keeps the function name, doc and (partial) signature
+    assert task2.task == "second" and task2.__doc__ == "second task"
+    assert list(inspect.signature(task2).parameters) == ["package", "verbose"]
+
+    registry.add(first.spec)
+    for kwargs in [{"name": "second"}, {"name": "a"}, {"aliases": ["second"]}]:
+        with pytest.raises(tasks.TaskRegistryError, match="duplicate task"):
+            with tasks.registering(registry):
+                tasks.task(**kwargs)(print)
+    assert len(registry) == 2
+
+    # only the tasks made in the registry path are added
+    registry = tasks.Registry(tmp_path / "make.py")
+    with tasks.registering(registry):
+        tasks.task()(print)
+    assert not registry
+
+
+def test_main_registry(makepy, tmp_path, capsys):
+    makepy("d")
+    assert capsys.readouterr().out == "checking\n"
+
+    with pytest.raises(SystemExit) as exc:
+        makepy()
+    assert exc.value.code == 0
+    assert "  docs:build - no help available" in capsys.readouterr().err
+
+    path = tmp_path / "make.py"
+    path.write_text(MAKEPY + "\n@api.task(name='checks')\ndef other():\n    pass\n")
+    with pytest.raises(cli.CliBaseError, match="duplicate task 'checks'"):
+        makepy("checks")
+
+
+@pytest.fixture()
+def makepy(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    path = tmp_path / "make.py"
+    path.write_text(MAKEPY)
+
+    def run(*arguments):
+        argv = ["makepyz", "-c", str(path), "--build-dir", str(tmp_path / "build")]
+        argv.extend(arguments)
+        with mock.patch.object(sys, "argv", argv):
+            makepyzui.main()
+
+    return run
+
+
+def test_main_depends(makepy, monkeypatch):
+    calls = []
+
+    def call(command, arguments):
+        calls.append((command.task, arguments))
+        return original(command, arguments)
+
+    original = makepyzui.call
+    monkeypatch.setattr(makepyzui, "call", call)
+    makepy("tests", "pack", "--", "-o", "x")
+    assert calls == [("checks", []), ("tests", []), ("pack", ["-o", "x"])]
+
+    with pytest.raises(SystemExit) as exc:
+        makepy("loop")
+    assert exc.value.code == 2
+
+
+def test_scheduler():
+    import threading
+
+    from makepyz import scheduler
+
+    graph = {"a": [], "b": [], "c": ["a", "b"], "bad": [], "after": ["bad"]}
+    barrier = threading.Barrier(2, timeout=5)
+    done = []
+
+    def execute(name):
+        if name in {"a", "b"}:
+            # a and b can only pass the barrier if running concurrently
+            barrier.wait()
+        if name == "bad":
+            raise ValueError(name)
+        done.append(name)
+
+    results = scheduler.run(graph, ["a", "b", "c"], execute, jobs=2)
+    assert done[-1] == "c"
+    assert {r.status for r in results.values()} == {"completed"}
+
+    done.clear()
+    order = tasks.resolve(graph, ["after", "a", "b", "c"])
+    with pytest.raises(tasks.TaskError, match="bad"):
+        scheduler.run(graph, order, execute, jobs=2, keep_going=True)
+    assert sorted(done) == ["a", "b", "c"]
+
+    pytest.raises(ValueError, scheduler.run, graph, ["bad"], execute)
+
+    # sys.exit(0) completes a task, a non zero code fails it (sequentially too)
+    def exits(name):
+        done.append(name)
+        raise SystemExit(0 if name == "a" else 3)
+
+    for jobs in [1, 2]:
+        done.clear()
+        results = scheduler.run(graph, ["a"], exits, jobs=jobs)
+        assert results["a"].status == "completed"
+        with pytest.raises(tasks.TaskError, match="failed task.*bad"):
+            scheduler.run(graph, ["bad", "after"], exits, jobs=jobs)
+        assert done == ["a", "bad"]
+
+
+def test_main_jobs(makepy, capsys, caplog):
+    makepy("-j", "2", "pack")
+    assert capsys.readouterr().out == "[checks] checking\n"
+
+    # the subprocesses output too
+    with caplog.at_level("INFO"):
+        makepy("-j", "2", "sub")
+    assert capsys.readouterr().out == "[sub] check_call\n"
+    assert "[sub] [python" in caplog.text and "] run\n" in caplog.text
+
+    makepy("checks")
+    assert capsys.readouterr().out == "checking\n"
+
+    # a dependency exiting with 0 completed
+    makepy("post")
+    assert capsys.readouterr().out == "pre\npost\n"
+    makepy("-j", "2", "post")
+    assert capsys.readouterr().out == "[pre] pre\n[post] post\n"
+
+
+def test_main_jobs_failed(makepy, monkeypatch, caplog):
+    def call(cmd, arguments):
+        raise RuntimeError(f"broken {cmd.task}")
+
+    monkeypatch.setattr(makepyzui, "call", call)
+    for args in [["-j", "2"], ["-k"]]:
+        caplog.clear()
+        with pytest.raises(cli.CliBaseError, match="failed task.*checks"):
+            makepy(*args, "pack")
+        assert "un-handled exception" not in caplog.text
+        assert caplog.text.count("broken checks") == 1
+
+
+def test_main_uptodate(makepy, tmp_path, monkeypatch, capsys):
+    calls = []
+    monkeypatch.setattr(makepyzui, "call", lambda cmd, arguments: calls.append(cmd))
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "a.txt").write_text("A")
+
+    def gen(*arguments):
+        calls.clear()
+        makepy("gen", *arguments)
+        (tmp_path / "out.txt").touch()
+        return len(calls)
+
+    assert gen() == 1
+    assert (tmp_path / "build" / "makepyz-state.json").exists()
+    assert gen() == 0
+    assert "'gen' is up to date" in capsys.readouterr().err
+
+    # new arguments, inputs or missing outputs trigger a run
+    assert gen("x") == 1
+    assert gen("x") == 0
+    (tmp_path / "data" / "b.txt").write_text("B")
+    assert gen("x") == 1
+    (tmp_path / "out.txt").unlink()
+    assert gen("x") == 1
+    assert gen("x") == 0
+
+    calls.clear()
+    makepy("-B", "gen", "x")
+    assert len(calls) == 1
+
+    # touching a file without changing it doesn't count
+    os.utime(tmp_path / "data" / "a.txt", ns=(0, 1))
+    assert gen("x") == 0
+
+
+def test_main_cache(makepy, tmp_path, monkeypatch):
+    import shutil
+
+    calls = []
+
+    def call(command, arguments):
+        calls.append(command.task)
+        return original(command, arguments)
+
+    original = makepyzui.call
+    monkeypatch.setattr(makepyzui, "call", call)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "a.txt").write_text("A")
+
+    def cached(*arguments):
+        calls.clear()
+        # a clean checkout: no outputs, no state
+        shutil.rmtree(tmp_path / "gen", ignore_errors=True)
+        shutil.rmtree(tmp_path / "build", ignore_errors=True)
+        makepy("cached", *arguments)
+        return (tmp_path / "gen" / "a.txt").read_text(), len(calls)
+
+    assert cached() == ("A", 1)
+    assert cached() == ("A", 0)
+    assert cached("x") == ("A", 1)
+
+    monkeypatch.setenv("GEN", "!")
+    assert cached() == ("A!", 1)
+    assert cached() == ("A!", 0)
+
+    (tmp_path / "data" / "a.txt").write_text("B")
+    assert cached() == ("B!", 1)
+    (tmp_path / "data" / "a.txt").write_text("A")
+    assert cached() == ("A!", 0)
+
+    # the state keeps track of the env variables and of the task source
+    monkeypatch.delenv("GEN")
+    makepy("cached")
+    monkeypatch.setenv("GEN", "?")
+    calls.clear()
+    makepy("cached")
+    assert ((tmp_path / "gen" / "a.txt").read_text(), len(calls)) == ("A?", 1)
+
+    path = tmp_path / "make.py"
+    path.write_text(path.read_text().replace('os.getenv("GEN", "")', '"-"'))
+    calls.clear()
+    makepy("cached")
+    assert ((tmp_path / "gen" / "a.txt").read_text(), len(calls)) == ("A-", 1)
+
+
+def test_context(makepy, tmp_path, monkeypatch, capsys):
+    import threading
+
+    monkeypatch.setattr(tasks, "BASEDIR", tmp_path)
+    cwd = os.getcwd()
+    seen = {}
+
+    @tasks.task()
+    def inner(ctx):
+        return ctx
+
+    @tasks.task()
+    def outer(name, ctx, workdir):
+        assert inner() is ctx
+        assert tasks.context() is ctx
+        seen[name] = (ctx.path("a"), ctx.build("b"), workdir, os.getcwd())
+
+    # outside makepyz a context is made from BASEDIR
+    outer("default")
+    assert seen["default"] == (
+        tmp_path / "a",
+        tmp_path / "build" / "b",
+        Path(cwd),
+        cwd,
+    )
+
+    def worker(name):
+        base = tmp_path / name
+        with tasks.using(tasks.Context(base, base / "out", name=name)) as ctx:
+            assert ctx.logger.name == f"makepyz.tasks.{name}"
+            outer(name)
+
+    threads = [threading.Thread(target=worker, args=(f"t{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(4):
+        assert seen[f"t{i}"][:2] == (
+            tmp_path / f"t{i}" / "a",
+            tmp_path / f"t{i}" / "out" / "b",
+        )
+    assert os.getcwd() == cwd
+
+    monkeypatch.setattr(tasks, "BASEDIR", None)
+    pytest.raises(RuntimeError, tasks.context)
+
+    # makepyz runs tasks requiring them
+    makepy("where")
+    assert capsys.readouterr().out == f"where True True {tmp_path}\n"
+
+    result = tasks.Context(tmp_path, tmp_path, env={"X": "1"}).run(
+        [sys.executable, "-c", "import os; print(os.getcwd(), os.getenv('X'))"]
+    )
+    assert result.stdout == [f"{tmp_path} 1"]
+
+
+def test_tests_failed(tmp_path, monkeypatch, caplog):
+    from makepyz import fileops
+
+    def run(args, **kwargs):
+        return fileops.RunResult(args, 1, 0.1, stdout=["FAILED test_x"])
+
+    monkeypatch.setattr(fileops, "run", run)
+    ctx = tasks.Context(tmp_path, tmp_path, name="tests")
+    with tasks.using(ctx), caplog.at_level("WARNING"):
+        with pytest.raises(subprocess.CalledProcessError) as exc:
+            tasks.tests([])
+    assert exc.value.output == "FAILED test_x"
+    # shown even when the streamed output is hidden (-q)
+    assert "[pytest] FAILED test_x" in caplog.text
+
+
+def test_main_watch(makepy, tmp_path, monkeypatch):
+    from makepyz import watch
+
+    calls = []
+    monkeypatch.setattr(
+        makepyzui, "call", lambda cmd, arguments: calls.append(cmd.task)
+    )
+
+    def changes(inputs, basedir, outputs):
+        assert set(inputs) == {"gen"}
+        assert outputs == ["out.txt"]
+        calls.append("-")
+        yield {"gen"}
+        calls.append("-")
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(watch, "watch", changes)
+    (tmp_path / "data").mkdir()
+    makepy("-w", "-B", "checks", "gen")
+    assert calls == ["checks", "gen", "-", "gen", "-"]
+
+    with pytest.raises(SystemExit) as exc:
+        makepy("-w", "checks")
+    assert exc.value.code == 2
+
+
+def test_main_profile_trace(makepy, tmp_path, caplog):
+    import json
+    import logging
+    import pstats
+
+    with caplog.at_level(logging.INFO):
+        makepy("-j", "2", "--profile", "--trace", "trace.json", "tests", "--", "x")
+    assert "--profile runs the tasks sequentially" in caplog.text
+
+    data = json.loads((tmp_path / "build" / "trace.json").read_text())
+    names = [e["name"] for e in data["traceEvents"] if e["cat"] == "task"]
+    assert names == ["checks", "tests"]
+    stats = pstats.Stats(str(tmp_path / "build" / "profile" / "tests.prof"))
+    assert any(func[2] == "tests" for func in stats.stats)  # type: ignore
+
+
+def test_main_list(makepy, tmp_path, capsys):
+    path = tmp_path / "make.py"
+    path.write_text(MAKEPY + "\nraise RuntimeError('executed')\n")
+
+    with pytest.raises(SystemExit) as exc:
+        makepy()
+    assert exc.value.code == 0
+    err = capsys.readouterr().err
+    assert "Commands:\n  info - this is the hello world\n  cached - no help" in err
+    assert "  loop - no help available" in err
+
+    argv = ["makepyz", "-c", str(path), "--help"]
+    with pytest.raises(SystemExit) as exc, mock.patch.object(sys, "argv", argv):
+        makepyzui.main()
+    assert exc.value.code == 0
+    out = capsys.readouterr().out
+    assert "--jobs" in out
+    assert "Commands:\n  info - this is the hello world" in out
+
+    # running a task executes make.py
+    with pytest.raises(SystemExit) as exc:
+        makepy("checks")
+    assert exc.value.code == 2
+
+
+def test_main_imported(makepy, tmp_path, monkeypatch, capsys):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "mytasks", raising=False)
+    (tmp_path / "mytasks.py").write_text(
+        "from makepyz import api\n\n\n@api.task()\ndef lint():\n"
+        '    """lints"""\n    print("linting")\n'
+    )
+    (tmp_path / "make.py").write_text("from mytasks import lint  # noqa: F401\n")
+
+    with pytest.raises(SystemExit) as exc:
+        makepy()
+    assert exc.value.code == 0
+    assert "  lint - lints" in capsys.readouterr().err
+
+    makepy("lint")
+    assert capsys.readouterr().out == "linting\n"
@@ -0,0 +1,43 @@
+import contextvars
+import json
+import sys
+import threading
+from pathlib import Path
+
+from makepyz import fileops, trace
+
+
+def test_tracer(tmp_path):
+    # no tracer, no spans
+    with trace.span("ignored", "task"):
+        pass
+
+    with trace.tracing() as tracer:
+        with trace.span("outer", "task", n=1):
+            fileops.run([sys.executable, "-c", "pass"])
+            # threads need the caller context to see the tracer
+            for context in [None, contextvars.copy_context()]:
+                args = ("t", "x", 0, 0.5)
+                thread = threading.Thread(
+                    target=context.run if context else trace.record,
+                    args=(trace.record, *args) if context else args,
+                )
+                thread.start()
+                thread.join()
+    assert trace.current.get() is None
+
+    exe = Path(sys.executable).name
+    assert [(s.name, s.category) for s in tracer.spans] == [
+        (exe, "subprocess"),
+        ("t", "x"),
+        ("outer", "task"),
+    ]
+    assert [name for name, _ in tracer.summary()] == ["outer"]
+    assert tracer.summary("x") == [("t", 0.5)]
+
+    data = json.loads(tracer.write(tmp_path / "trace.json").read_text())
+    events = {e["name"]: e for e in data["traceEvents"]}
+    assert events["outer"]["ph"] == "X"
+    assert events["outer"]["args"] == {"n": "1"}
+    assert events["outer"]["dur"] >= events[exe]["dur"]
+    assert events[exe]["args"]["returncode"] == "0"
@@ -0,0 +1,66 @@
+import threading
+
+from makepyz import watch
+
+
+def test_snapshot(tmp_path):
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "src" / "pkg" / "a.py").write_text("a")
+    (tmp_path / "src" / "b.txt").write_text("bb")
+
+    assert watch.snapshot(["src/**/*.py"], tmp_path) == {
+        "src/pkg/a.py": (
+            (tmp_path / "src" / "pkg" / "a.py").stat().st_mtime_ns,
+            1,
+        )
+    }
+    assert set(watch.snapshot(["src/**/*"], tmp_path)) == {"src/pkg/a.py", "src/b.txt"}
+
+
+def test_affected():
+    graph = {"a": [], "b": ["a"], "c": ["b"], "d": []}
+    order = ["a", "d", "b", "c"]
+    assert watch.affected(graph, order, {"a"}) == ["a", "b", "c"]
+    assert watch.affected(graph, order, {"b", "d"}) == ["d", "b", "c"]
+    assert watch.affected(graph, order, set()) == []
+
+
+def test_watch(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    inputs = {"first": ["a.txt"], "second": ["*.py"]}
+    stop = threading.Event()
+    events = watch.watch(
+        inputs, tmp_path, interval=0.01, debounce=0.05, stop=stop, outputs=["z*.py"]
+    )
+
+    def change():
+        # a burst of changes is reported once
+        for i in range(3):
+            (tmp_path / f"x{i}.py").write_text(str(i))
+            stop.wait(0.01)
+
+    thread = threading.Thread(target=change)
+    thread.start()
+    assert next(events) == {"second"}
+    thread.join()
+
+    def later(path, txt):
+        timer = threading.Timer(0.1, path.write_text, [txt])
+        timer.start()
+        return timer
+
+    later(tmp_path / "a.txt", "changed")
+    assert next(events) == {"first"}
+
+    # the declared outputs written while handling a report (eg. by the
+    # tasks) are not changes, the inputs saved meanwhile are
+    (tmp_path / "z.py").write_text("output")
+    (tmp_path / "x0.py").write_text("saved")
+    assert next(events) == {"second"}
+    (tmp_path / "z.py").write_text("output again")
+    timer = later(tmp_path / "a.txt", "last")
+    assert next(events) == {"first"}
+    timer.join()
+
+    stop.set()
+    assert list(events) == []